@@ -1,11 +1,14 @@
 import logging
+import os
 
-from annoy import AnnoyIndex
 from django.conf import settings as st
-import gensim
-from sklearn.externals import joblib
 
-from api.helpers.utils import connect_to
+from api.helpers.artifacts import load_artifact
+from api.helpers.bundle import ModelManager
+from api.helpers.cache import ResultCache
+from api.helpers.room_store import RoomStore
+from api.helpers.session_index import SessionIndex
+from api.helpers.utils import MONGO_SCAN_READ_PREFERENCE, connect_to
 
 
 # logging config
@@ -15,30 +18,54 @@ logging.basicConfig(
 )
 logging.root.level = logging.INFO
 
-# initial mongo connection
+# initial mongo connection, one client per process
 room_col = connect_to(db=st.MONGO_DB, col=st.ROOMS_COL)
 col = connect_to(db=st.MONGO_DB, col=st.LOG_COL)
+# full scans of the logs can be served by secondaries
+log_scan_col = connect_to(
+    db=st.MONGO_DB, col=st.LOG_COL,
+    read_preference=MONGO_SCAN_READ_PREFERENCE
+)
+
+# in-process room metadata, refreshed in background
+room_store = RoomStore(room_col)
+load_artifact("room_store", room_store.load)
+
+# recent room views per session / ip address, fed from the log collection
+session_index = SessionIndex(col)
+
+# models and indexes of the current version, swapped after a retrain
+models = ModelManager()
+models.load()
+
+# recommendation results of the current model version
+result_cache = ResultCache()
+
+
+_started = None
+
+
+def start():
+    """
+    Start the background refreshes of this process, once
+
+    A gunicorn master preloading the app only loads the models and the
+    room store: its threads would serve nothing and would not survive
+    the fork, they start in each worker, see `gunicorn_conf.py`
+    """
+    global _started
+    if _started == os.getpid():
+        return
+    _started = os.getpid()
+
+    if room_store.snapshot is not None:
+        room_store.start()
+    try:
+        session_index.start()
+    except Exception as e:
+        logging.exception(e)
+    models.start()
+
 
-# load pre-trained model
-try:
-    model = gensim.models.Word2Vec.load(
-        st.MODEL_ITEM2VEC
-    )
-except Exception as e:
-    logging.exception(e)
-    model = None
-
-try:
-    fb_model = joblib.load(
-        st.MODEL_FEATURE_BASED
-    )
-except Exception as e:
-    logging.exception(e)
-    fb_model = None
-
-try:
-    ann = AnnoyIndex(st.DIMS)
-    ann.load(st.MODEL_ANNOY_INDEX_FB)
-except Exception as e:
-    logging.exception(e)
-    ann = None
+if os.environ.get("API_DEFER_START") != "1":
+    start()
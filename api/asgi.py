@@ -0,0 +1,158 @@
+"""
+Async serving mode: a thin ASGI application around the recommenders,
+same contract as `POST luxstay` of the django app
+
+    gunicorn -k uvicorn.workers.UvicornWorker api.asgi:application
+
+`DJANGO_SETTINGS_MODULE` must be set, as for `manage.py`.
+"""
+import io
+import json
+import logging
+import time
+
+import django
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import QueryDict
+from django.http.multipartparser import MultiPartParser, MultiPartParserError
+
+django.setup()
+
+from api.forms.room_form import LuxstayRoomForm  # noqa
+from api.helpers.async_recommenders import (  # noqa
+    custom_recommender_async,
+    room_similar_async
+)
+from api.helpers.recommenders import GEO_RADIUS_KM  # noqa
+from api.helpers.response_format import dict_format  # noqa
+from api.helpers.tracing import metrics, sample, span  # noqa
+
+
+ROUTE = "/luxstay"
+METRICS_ROUTE = "/luxstay/metrics"
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def parse_form(headers, body):
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    if content_type.startswith("multipart/form-data"):
+        meta = {
+            "CONTENT_TYPE": content_type,
+            "CONTENT_LENGTH": str(len(body)),
+        }
+        data, _ = MultiPartParser(meta, io.BytesIO(body), []).parse()
+        return data
+    if content_type.startswith("application/json"):
+        return json.loads(body.decode("utf-8") or "{}")
+    return QueryDict(body)
+
+
+async def send_body(send, status, content_type, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, data, trace=None):
+    with span("serialization", trace):
+        body = json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+    await send_body(send, status, b"application/json", body)
+
+
+def trace_name(form):
+    if form.cleaned_data.get("custom_session_id") or \
+            form.cleaned_data.get("ip_address"):
+        return "custom_recommender"
+    return "room_similar"
+
+
+async def recommend(form, trace=None):
+    custom_session_id = form.cleaned_data.get("custom_session_id") or None
+    ip_address = form.cleaned_data.get("ip_address") or None
+    room_id = form.cleaned_data.get("room_id")
+
+    # custom recommend for each user
+    if custom_session_id is not None or ip_address is not None:
+        logging.info(
+            "Custom recommender :: custom_session_id:%s - ip_address:%s",
+            custom_session_id, ip_address
+        )
+        return await custom_recommender_async(
+            custom_session_id, ip_address, 20, trace=trace
+        )
+    radius_km = form.cleaned_data.get("radius_km")
+    if radius_km is None:
+        radius_km = GEO_RADIUS_KM
+    return await room_similar_async(room_id, 20, radius_km, trace=trace)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    path = scope["path"].rstrip("/")
+    if path == METRICS_ROUTE and scope["method"] == "GET":
+        return await send_body(
+            send, 200, b"text/plain; version=0.0.4",
+            metrics.render().encode("utf-8")
+        )
+    if path != ROUTE:
+        return await send_json(send, 404, dict_format(
+            code=404, message="Not found", data=[], errors=True
+        ))
+    if scope["method"] != "POST":
+        return await send_json(send, 405, dict_format(
+            code=405, message="Method not allowed", data=[], errors=True
+        ))
+
+    start_ = time.time()
+    body = await read_body(receive)
+    try:
+        form = LuxstayRoomForm(parse_form(dict(scope["headers"]), body))
+    except (ValueError, MultiPartParserError):
+        return await send_json(send, 400, dict_format(
+            code=400, message="Malformed body", data=[], errors=True
+        ))
+    if not form.is_valid():
+        return await send_json(send, 422, form.errors)
+
+    trace = sample(trace_name(form))
+    try:
+        try:
+            result = await recommend(form, trace)
+        except Exception as e:
+            logging.exception(e)
+            result = dict_format(
+                code=500, message="Internal server error", data=[],
+                errors=True
+            )
+        await send_json(send, result["code"], result, trace)
+    finally:
+        # also when the client went away during the send
+        if trace is not None:
+            trace.finish()
+    logging.info("Async recommend :: took:%.4f's", time.time() - start_)
@@ -1,10 +1,53 @@
 from django import forms
+from django.conf import settings as st
 
 from api.forms.abstract_form import AbstractForm
 
 
+BATCH_MAX_ITEMS = getattr(st, "BATCH_MAX_ITEMS", 100)
+
+
 class LuxstayRoomForm(AbstractForm):
     custom_session_id = forms.CharField(required=False, initial=None)
     ip_address = forms.CharField(required=False, initial=None)
 
     room_id = forms.IntegerField(required=False, initial=None)
+    # only recommend rooms within this distance of the room
+    radius_km = forms.FloatField(required=False, min_value=0)
+
+
+class CommaSeparatedField(forms.CharField):
+    def __init__(self, *args, item_type=str, **kwargs):
+        self.item_type = item_type
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        value = super().to_python(value)
+        try:
+            return [
+                self.item_type(item.strip())
+                for item in value.split(",") if item.strip()
+            ]
+        except ValueError:
+            raise forms.ValidationError("Enter a comma separated list.")
+
+
+class LuxstayBatchForm(AbstractForm):
+    room_ids = CommaSeparatedField(required=False, item_type=int)
+    custom_session_ids = CommaSeparatedField(required=False)
+
+    topn = forms.IntegerField(required=False, initial=20, min_value=1)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        no_items = len(cleaned_data.get("room_ids") or []) + \
+            len(cleaned_data.get("custom_session_ids") or [])
+        if no_items == 0:
+            raise forms.ValidationError(
+                "Must be included `room_ids` or `custom_session_ids`"
+            )
+        if no_items > BATCH_MAX_ITEMS:
+            raise forms.ValidationError(
+                "At most {} items per request".format(BATCH_MAX_ITEMS)
+            )
+        return cleaned_data
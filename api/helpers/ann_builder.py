@@ -0,0 +1,168 @@
+import logging
+import time
+
+from annoy import AnnoyIndex
+from django.conf import settings as st
+from gensim.similarities.index import AnnoyIndexer
+import numpy as np
+from tabulate import tabulate
+
+from api.helpers.neighbors import normalize, top_k
+from api.helpers.utils import save_atomic
+
+
+I2V_ANNOY_TREES = getattr(st, "I2V_ANNOY_TREES", 100)
+FB_ANNOY_TREES = getattr(st, "FB_ANNOY_TREES", 10)
+# -1: annoy default, n_trees * n
+ANNOY_SEARCH_K = getattr(st, "ANNOY_SEARCH_K", -1)
+ANNOY_JOBS = getattr(st, "ANNOY_JOBS", -1)
+ADD_CHUNK_SIZE = 10000
+
+
+class SearchKAnnoyIndexer(AnnoyIndexer):
+    """gensim `AnnoyIndexer` querying with `search_k`"""
+
+    search_k = ANNOY_SEARCH_K
+
+    def most_similar(self, vector, num_neighbors):
+        ids, distances = self.index.get_nns_by_vector(
+            vector, num_neighbors,
+            search_k=self.search_k, include_distances=True
+        )
+        return [
+            (self.labels[ids[i]], 1 - distances[i] / 2)
+            for i in range(len(ids))
+        ]
+
+
+def build_annoy(vectors,
+                n_trees,
+                ids=None,
+                metric="angular",
+                fpath=None,
+                n_jobs=ANNOY_JOBS):
+    """
+    Build an annoy index from a matrix
+
+    :param vectors: (n, dims) matrix, copied once to contiguous float32
+    :param ids: item id of each row, default to the row number
+    :param fpath: build on disk and publish the index to `fpath`
+    :param n_jobs: build threads, -1 for all cores (annoy >= 1.17)
+    """
+    start_ = time.time()
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ids = np.arange(len(vectors)) if ids is None else np.asarray(ids)
+
+    index = AnnoyIndex(vectors.shape[1], metric)
+
+    def build(tmp_path=None):
+        on_disk = tmp_path is not None and hasattr(index, "on_disk_build")
+        if on_disk:
+            # nodes are written to the file instead of the heap
+            index.on_disk_build(tmp_path)
+
+        for start in range(0, len(vectors), ADD_CHUNK_SIZE):
+            chunk = vectors[start:start + ADD_CHUNK_SIZE].tolist()
+            for item, vector in zip(ids[start:start + ADD_CHUNK_SIZE], chunk):
+                index.add_item(int(item), vector)
+
+        try:
+            index.build(n_trees, n_jobs)
+        except TypeError:
+            # annoy < 1.17 builds on one thread
+            index.build(n_trees)
+
+        if tmp_path is not None and not on_disk:
+            index.save(tmp_path)
+
+    if fpath is None:
+        build()
+    else:
+        save_atomic(build, fpath)
+
+    logging.info(
+        "Build annoy index :: items:%d - trees:%d - took:%.2f's",
+        len(vectors), n_trees, time.time() - start_
+    )
+    return index
+
+
+def build_item2vec_indexer(model, fpath, n_trees=I2V_ANNOY_TREES):
+    """Build and save the annoy indexer of an item2vec model"""
+    model.init_sims()
+
+    annoy_index = SearchKAnnoyIndexer()
+    annoy_index.model = model
+    annoy_index.num_trees = n_trees
+    annoy_index.index = build_annoy(model.wv.vectors_norm, n_trees)
+    annoy_index.labels = model.wv.index2word
+
+    # `fpath.d` is renamed last, its presence marks a complete index
+    save_atomic(annoy_index.save, fpath, sidecars_last=True)
+    return annoy_index
+
+
+def exact_neighbors(vectors, queries, k, metric="angular"):
+    if metric == "angular":
+        sims = normalize(vectors[queries]) @ normalize(vectors).T
+    else:
+        sims = -(
+            (vectors[queries] ** 2).sum(axis=1, keepdims=True) -
+            2 * vectors[queries] @ vectors.T +
+            (vectors ** 2).sum(axis=1)
+        )
+    return top_k(sims, k)[0]
+
+
+def recall_report(vectors,
+                  trees=(10, 50, 100),
+                  search_ks=(-1,),
+                  k=10,
+                  n_queries=200,
+                  metric="angular",
+                  seed=0):
+    """
+    Recall@k and query latency of annoy indexes against exact brute force,
+    for each (n_trees, search_k), to choose the settings from data
+
+    :return list: rows of (trees, search_k, recall, ms/query, build's)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    rng = np.random.RandomState(seed)
+    queries = rng.choice(
+        len(vectors), min(n_queries, len(vectors)), replace=False
+    )
+    exact = exact_neighbors(vectors, queries, k, metric)
+
+    rows = []
+    for n_trees in trees:
+        start_ = time.time()
+        index = build_annoy(vectors, n_trees, metric=metric)
+        build_time = time.time() - start_
+
+        for search_k in search_ks:
+            hits = 0
+            start_ = time.time()
+            for query, truth in zip(queries, exact):
+                approx = index.get_nns_by_vector(
+                    vectors[query], k, search_k=search_k
+                )
+                hits += len(set(approx) & set(truth.tolist()))
+            latency = (time.time() - start_) / len(queries)
+
+            rows.append((
+                n_trees, search_k,
+                round(hits / float(k * len(queries)), 4),
+                round(latency * 1000, 3),
+                round(build_time, 2)
+            ))
+
+    table = tabulate(
+        rows, headers=["trees", "search_k", "recall", "ms/query", "build's"]
+    )
+    logging.info(
+        "Recall vs latency :: k:%d - queries:%d\n%s",
+        k, len(queries), table
+    )
+    return rows
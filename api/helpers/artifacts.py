@@ -0,0 +1,205 @@
+import logging
+import os
+import shutil
+import time
+
+from django.conf import settings as st
+from gensim.models import KeyedVectors, Word2Vec
+import numpy as np
+
+from api.helpers.embeddings import MODEL_FB_EMBEDDINGS
+from api.helpers.neighbors import MODEL_NEIGHBORS, normalize
+from api.helpers.utils import rss, save_atomic
+
+
+MODEL_VERSION_PATH = getattr(
+    st, "MODEL_VERSION_PATH", os.path.join(st.BASE_MODEL, "VERSION")
+)
+# one immutable directory per published version, `current` links to one
+MODEL_VERSIONS_DIR = getattr(
+    st, "MODEL_VERSIONS_DIR", os.path.join(st.BASE_MODEL, "versions")
+)
+MODEL_CURRENT_PATH = getattr(
+    st, "MODEL_CURRENT_PATH", os.path.join(st.BASE_MODEL, "current")
+)
+MODEL_KEEP_VERSIONS = getattr(st, "MODEL_KEEP_VERSIONS", 3)
+
+
+def artifact_path(fpath, root=None):
+    """`fpath` of an artifact in `st.BASE_MODEL`, or in the version `root`"""
+    if root is None:
+        return fpath
+    return os.path.join(root, os.path.basename(fpath))
+
+
+def artifact_prefixes():
+    """Serving artifacts, each one is every file named `prefix[.*]`"""
+    return [
+        MODEL_KEYED_VECTORS,
+        st.MODEL_ITEM2VEC,
+        MODEL_NEIGHBORS,
+        st.MODEL_ANNOY_INDEX,
+        st.MODEL_ANNOY_INDEX_FB,
+        MODEL_FB_EMBEDDINGS,
+        st.MODEL_FEATURE_BASED,
+    ]
+
+
+def artifact_files(base_dir=st.BASE_MODEL):
+    names = [os.path.basename(prefix) for prefix in artifact_prefixes()]
+    files = []
+    for fname in sorted(os.listdir(base_dir)):
+        if fname.endswith(".tmp") or ".tmp." in fname:
+            continue
+        if any(fname == name or fname.startswith(name + ".")
+               for name in names):
+            files.append(os.path.join(base_dir, fname))
+    return files
+
+
+def _link(src, dst):
+    # every artifact is written with `save_atomic`, never in place:
+    # hard links are immutable snapshots
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _prune_versions(keep=MODEL_KEEP_VERSIONS, current=None):
+    versions = sorted(os.listdir(MODEL_VERSIONS_DIR), key=float)
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version != current:
+            # workers still serving it keep their mapped pages
+            shutil.rmtree(os.path.join(MODEL_VERSIONS_DIR, version))
+
+
+def publish_version(fpath=MODEL_VERSION_PATH):
+    """
+    Snapshot the artifacts in `st.BASE_MODEL` to a new version directory
+    and point `MODEL_CURRENT_PATH` to it in one atomic rename
+    """
+    version = "{:.6f}".format(time.time())
+    version_dir = os.path.join(MODEL_VERSIONS_DIR, version)
+    os.makedirs(version_dir)
+    for src in artifact_files():
+        _link(src, os.path.join(version_dir, os.path.basename(src)))
+
+    tmp_link = MODEL_CURRENT_PATH + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(
+        os.path.relpath(version_dir, os.path.dirname(MODEL_CURRENT_PATH)),
+        tmp_link
+    )
+    os.replace(tmp_link, MODEL_CURRENT_PATH)
+
+    tmp_path = fpath + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, fpath)
+    logging.info("Publish model version :: version:%s", version)
+
+    try:
+        _prune_versions(current=version)
+    except (OSError, ValueError) as e:
+        logging.exception(e)
+    return version
+
+
+def read_version(fpath=MODEL_VERSION_PATH):
+    try:
+        with open(fpath) as f:
+            return f.read().strip()
+    except OSError:
+        return "0"
+
+
+def current_version_dir():
+    """:return str: directory of the current version, None before any"""
+    if not os.path.isdir(MODEL_CURRENT_PATH):
+        return None
+    return os.path.realpath(MODEL_CURRENT_PATH)
+
+
+KEYED_VECTORS_KEY = getattr(
+    st, "KEYED_VECTORS_KEY", "{}_kv".format(st.ITEM2VEC_KEY)
+)
+MODEL_KEYED_VECTORS = getattr(
+    st, "MODEL_KEYED_VECTORS", os.path.join(st.BASE_MODEL, KEYED_VECTORS_KEY)
+)
+
+# load time and resident size of each artifact loaded at startup
+startup_stats = {}
+
+
+def keyed_vectors_paths(fpath):
+    """:return tuple: (pickle, vectors, normalized vectors) files"""
+    return fpath, fpath + ".vectors.npy", fpath + ".vectors_norm.npy"
+
+
+def save_keyed_vectors(wv, fpath=MODEL_KEYED_VECTORS):
+    """
+    Save the item2vec vectors for serving: the vectors and
+    their normalized copy are plain `.npy` files, memory-mapped by
+    `load_keyed_vectors` and shared by every worker
+    """
+    start_ = time.time()
+
+    def save(path):
+        wv.save(path, separately=["vectors"], ignore=["vectors_norm"])
+        np.save(keyed_vectors_paths(path)[2], normalize(wv.vectors))
+
+    # the pickle is replaced after the vectors it references
+    save_atomic(save, fpath)
+    logging.info(
+        "Save keyed vectors :: rooms:%d - took:%.2f's",
+        len(wv.vectors), time.time() - start_
+    )
+
+
+def load_keyed_vectors(fpath=MODEL_KEYED_VECTORS):
+    wv = KeyedVectors.load(fpath, mmap="r")
+    # precomputed: `init_sims` would copy the vectors in every worker
+    wv.vectors_norm = np.load(
+        keyed_vectors_paths(fpath)[2], mmap_mode="r"
+    )
+    return wv
+
+
+def load_item2vec_vectors(root=None):
+    """Keyed vectors of the item2vec model, without its training state"""
+    fpath = artifact_path(MODEL_KEYED_VECTORS, root)
+    if os.path.exists(fpath):
+        return load_keyed_vectors(fpath)
+
+    # models trained before the keyed vectors were saved apart
+    logging.info("Keyed vectors not found, load the whole item2vec model")
+    return Word2Vec.load(artifact_path(st.MODEL_ITEM2VEC, root)).wv
+
+
+def load_artifact(name, loader, *args, **kwargs):
+    """
+    `loader(*args, **kwargs)`, timed and recorded in `startup_stats`
+
+    :return: the artifact, or None when it can not be loaded
+    """
+    start_ = time.time()
+    rss_before = rss()
+    try:
+        artifact = loader(*args, **kwargs)
+    except Exception as e:
+        logging.exception(e)
+        artifact = None
+
+    stats = {
+        "loaded": artifact is not None,
+        "load_time": round(time.time() - start_, 4),
+        "rss_delta": rss() - rss_before,
+    }
+    startup_stats[name] = stats
+    logging.info(
+        "Load artifact :: name:%s - took:%.2f's - rss:+%.1fMB",
+        name, stats["load_time"], stats["rss_delta"] / 1024 ** 2
+    )
+    return artifact
@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+
+from django.conf import settings as st
+
+from api.helpers.recommenders import (
+    GEO_RADIUS_KM,
+    cacheable,
+    geo_candidates,
+    get_last_room_session,
+    lookup_lat_long,
+    rerank_by_distance,
+    room_candidates,
+    room_ids_of,
+    room_not_found,
+    room_result,
+    session_not_found,
+    session_recommender
+)
+from api.helpers.tracing import bind
+from api import models, room_col, result_cache
+
+
+# mongo calls mostly wait on the network
+ASYNC_IO_WORKERS = getattr(st, "ASYNC_IO_WORKERS", 32)
+# numpy and annoy release the GIL, one thread per core is enough
+ASYNC_CPU_WORKERS = getattr(st, "ASYNC_CPU_WORKERS", os.cpu_count() or 1)
+
+io_pool = ThreadPoolExecutor(ASYNC_IO_WORKERS)
+cpu_pool = ThreadPoolExecutor(ASYNC_CPU_WORKERS)
+
+
+# loop of the running coroutine (python >= 3.7), same on older versions
+get_running_loop = getattr(
+    asyncio, "get_running_loop", asyncio.get_event_loop
+)
+
+
+def run_in(pool, func, *args, trace=None, **kwargs):
+    """:param trace: `Trace` of the request, spans of `func` go to it"""
+    loop = get_running_loop()
+    return loop.run_in_executor(
+        pool, functools.partial(bind(trace, func), *args, **kwargs)
+    )
+
+
+async def room_similar_async(room_id,
+                             topn=20,
+                             radius_km=GEO_RADIUS_KM,
+                             trace=None):
+    """
+    `room_similar` with the similarity search on `cpu_pool` and
+    the coordinates lookup on `io_pool`, the event loop never blocks
+
+    :param trace: see `tracing.sample`
+    :return dict: see `dict_format`
+    """
+    # one bundle for the whole request, see `ModelManager`
+    bundle = models.current
+    key = ("room_similar", bundle.version, room_id, topn, radius_km)
+    result = result_cache.get(*key)
+    if result is not None:
+        return result
+
+    if radius_km:
+        candidates = await run_in(
+            cpu_pool, geo_candidates, bundle, room_id, topn, radius_km,
+            trace=trace
+        )
+    else:
+        candidates = await run_in(
+            cpu_pool, room_candidates, bundle, room_id, topn, trace=trace
+        )
+    if candidates is None:
+        return room_not_found()
+    mode, room_ids = candidates
+
+    lat_long = await run_in(
+        io_pool, lookup_lat_long, room_col,
+        [int(room_id)] + room_ids_of(room_ids),
+        trace=trace
+    )
+    result = room_result(mode, bind(trace, rerank_by_distance)(
+        room_id, room_ids, lat_long, return_sim=True, topn=topn
+    ))
+    if cacheable(result):
+        result_cache.set(result, *key)
+    return result
+
+
+async def custom_recommender_async(custom_session_id,
+                                   ip_address,
+                                   topn=20,
+                                   trace=None):
+    """
+    `custom_recommender` with the session lookup on `io_pool` and
+    the similarity search on `cpu_pool`
+
+    :return dict: see `dict_format`
+    """
+    bundle = models.current
+    room_ids = await run_in(
+        io_pool, get_last_room_session,
+        custom_session_id, ip_address,
+        no_limit=st.NO_LIMIT,
+        no_items=st.NO_ITEMS,
+        trace=trace
+    )
+    if room_ids is None:
+        return session_not_found()
+
+    return await run_in(
+        cpu_pool, session_recommender, bundle, room_ids, topn,
+        trace=trace
+    )
@@ -0,0 +1,195 @@
+from contextlib import contextmanager
+import datetime
+import resource
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+# a fixed vocabulary for listing texts, Vietnamese as in production
+WORDS = (
+    "phong ngu can ho view bien trung tam gan cho dem yen tinh rong rai "
+    "sach se day du tien nghi bep may giat wifi ban cong ho boi thang may "
+    "gia re gia dinh nhom ban du lich cong tac"
+).split()
+AMENITIES = [
+    "wifi", "tv", "kitchen", "washer", "air_conditioning", "pool",
+    "parking", "elevator", "balcony", "breakfast", "gym", "hot_water"
+]
+# (latitude, longitude) of the main cities
+CITIES = [
+    (21.0278, 105.8342), (10.8231, 106.6297), (16.0544, 108.2022),
+    (12.2388, 109.1967), (11.9404, 108.4583), (10.2899, 103.9840),
+    (20.9101, 107.1839), (15.8801, 108.3380),
+]
+
+
+def synthetic_content(rng, no_words=80):
+    words = rng.choice(WORDS, no_words)
+    return (
+        "<p><b>{}</b> {}</p><br/><p>Lien he: host{}@example.com "
+        "https://example.com/r/{} {}m2, {} phong</p>".format(
+            " ".join(words[:5]), " ".join(words[5:]),
+            rng.randint(1000), rng.randint(10 ** 6),
+            rng.randint(20, 200), rng.randint(1, 5)
+        )
+    )
+
+
+def synthetic_rooms(no_rooms, seed=0):
+    """
+    Listed rooms around `CITIES`, in the schema of the rooms collection
+
+    :return (docs, cities): room documents and the city of each room
+    """
+    rng = np.random.RandomState(seed)
+    cities = rng.randint(len(CITIES), size=no_rooms)
+    docs = []
+    for i, city in enumerate(cities):
+        lat, long = CITIES[city]
+        room_id = i + 1
+        docs.append({
+            "id": room_id,
+            "status": "Listed",
+            "submit_status": "Approved",
+            "name": " ".join(rng.choice(WORDS, 6)),
+            "content": synthetic_content(rng),
+            "amenities": ",".join(
+                rng.choice(AMENITIES, rng.randint(1, 8), replace=False)
+            ),
+            "room_address": {
+                "room_id": room_id,
+                "latitude": lat + rng.normal(0, 0.05),
+                "longitude": long + rng.normal(0, 0.05),
+            },
+        })
+    return docs, cities
+
+
+def synthetic_sessions(cities, clicks_per_room=20, min_=2, max_=30, seed=0):
+    """
+    Sessions browsing rooms of one city, popular rooms more often
+
+    :return list: sessions of room ids (int)
+    """
+    rng = np.random.RandomState(seed)
+    by_city = [np.flatnonzero(cities == c) + 1 for c in range(len(CITIES))]
+    by_city = [rooms for rooms in by_city if len(rooms)]
+    # zipf-like popularity inside a city
+    weights = [1.0 / np.arange(1, len(rooms) + 1) for rooms in by_city]
+    weights = [w / w.sum() for w in weights]
+
+    no_clicks = clicks_per_room * len(cities)
+    sessions, total = [], 0
+    while total < no_clicks:
+        c = rng.randint(len(by_city))
+        length = rng.randint(min_, max_ + 1)
+        sessions.append(
+            rng.choice(by_city[c], length, p=weights[c]).tolist()
+        )
+        total += length
+    return sessions
+
+
+def synthetic_logs(sessions, seed=0):
+    """Click log documents of `sessions`, in the schema of the log"""
+    rng = np.random.RandomState(seed)
+    start = datetime.datetime(2019, 1, 1)
+    logs = []
+    for i, session in enumerate(sessions):
+        ip_address = "10.0.{}.{}".format(i // 256 % 256, i % 256)
+        for j, room_id in enumerate(session):
+            logs.append({
+                "custom_session_id": "session-{}".format(i),
+                "ip_address": ip_address,
+                "room_id": room_id,
+                "created_at": start + datetime.timedelta(
+                    seconds=int(i * 600 + j * rng.randint(10, 120))
+                ),
+            })
+    return logs
+
+
+def max_rss():
+    """Peak resident set size of the process in bytes"""
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(func, queries, warmup=5, memory_queries=20):
+    """
+    Latency of `func(query)` over `queries`, then the peak of memory
+    allocated by a few calls (traced apart, tracing slows calls down)
+
+    :return dict: p50/p95/p99 (ms), qps and peak memory (MB)
+    """
+    for query in queries[:warmup]:
+        func(query)
+
+    latencies = []
+    start_ = time.perf_counter()
+    for query in queries:
+        t = time.perf_counter()
+        func(query)
+        latencies.append(time.perf_counter() - t)
+    took = time.perf_counter() - start_
+
+    tracemalloc.start()
+    for query in queries[:memory_queries]:
+        func(query)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {
+        "queries": len(queries),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "qps": round(len(queries) / max(took, 1e-9), 1),
+        "peak_mb": round(peak / 1024 ** 2, 3),
+        "max_rss_mb": round(max_rss() / 1024 ** 2, 1),
+    }
+
+
+def measure_once(func):
+    """Time and peak memory of one long call, e.g. a training"""
+    tracemalloc.start()
+    start_ = time.perf_counter()
+    result = func()
+    took = time.perf_counter() - start_
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {
+        "took_s": round(took, 3),
+        "peak_mb": round(peak / 1024 ** 2, 3),
+        "max_rss_mb": round(max_rss() / 1024 ** 2, 1),
+    }
+
+
+@contextmanager
+def patched(module, **attrs):
+    """Replace module globals, e.g. the mongo collections, then restore"""
+    missing = object()
+    old = {name: getattr(module, name, missing) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield module
+    finally:
+        for name, value in old.items():
+            if value is missing:
+                delattr(module, name)
+            else:
+                setattr(module, name, value)
+
+
+def git_commit():
+    """:return str: HEAD of the repository, None outside of git"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,246 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings as st
+import numpy as np
+from sklearn.externals import joblib
+
+from api.helpers.artifacts import (
+    artifact_path,
+    current_version_dir,
+    load_artifact,
+    load_item2vec_vectors,
+    read_version
+)
+from api.helpers.embeddings import (
+    MODEL_FB_EMBEDDINGS,
+    EmbeddingTable,
+    embedding_paths
+)
+from api.helpers.neighbors import MODEL_NEIGHBORS, NeighborTable
+from api.helpers.registry import (
+    IndexRegistry,
+    annoy_indexer_loader,
+    annoy_loader
+)
+
+
+MODEL_CHECK_INTERVAL = getattr(st, "MODEL_CHECK_INTERVAL", 10)
+WARMUP_QUERIES = getattr(st, "WARMUP_QUERIES", 50)
+
+ITEM2VEC_INDEX = "item2vec"
+FEATURE_BASED_INDEX = "feature_based"
+
+
+def vocab_table(wv):
+    """
+    `EmbeddingTable` of the item2vec vectors, to map many room ids to
+    their vocabulary rows at once
+    """
+    ids = np.full(len(wv.index2word), -1, dtype=np.int64)
+    for row, word in enumerate(wv.index2word):
+        try:
+            ids[row] = int(word)
+        except ValueError:
+            continue
+    return EmbeddingTable(ids, wv.vectors)
+
+
+class ModelBundle:
+    """
+    Every model and index of one published version
+
+    A request reads one bundle from `ModelManager.current` and uses it
+    until the end, so it never mixes two versions.
+    """
+
+    def __init__(self, version, root=None):
+        self.version = version
+        self.root = root
+        self.wv = None
+        self.vocab = None
+        self.neighbors = None
+        self.fb_model = None
+        self.fb_embs = None
+        self.indexes = IndexRegistry()
+
+    @classmethod
+    def load(cls, version, root=None):
+        """
+        :param root: version directory, default to the artifacts of
+            `st.BASE_MODEL` (before the first versioned publish)
+        """
+        bundle = cls(version, root)
+
+        # vectors are memory-mapped: with gunicorn `preload_app` the pages
+        # are shared by every worker
+        bundle.wv = load_artifact("item2vec", load_item2vec_vectors, root)
+        if bundle.wv is not None:
+            bundle.vocab = vocab_table(bundle.wv)
+            bundle.neighbors = load_artifact(
+                "neighbors", NeighborTable.load, bundle.wv,
+                artifact_path(MODEL_NEIGHBORS, root)
+            )
+        bundle.fb_model = load_artifact(
+            "feature_based", joblib.load,
+            artifact_path(st.MODEL_FEATURE_BASED, root), mmap_mode="r"
+        )
+        # rows of the same build as `fb_model`, never reloaded apart
+        embs_prefix = artifact_path(MODEL_FB_EMBEDDINGS, root)
+        if bundle.fb_model is not None and \
+                os.path.exists(embedding_paths(embs_prefix)[1]):
+            bundle.fb_embs = load_artifact(
+                "feature_based_embeddings", EmbeddingTable.load, embs_prefix
+            )
+
+        # ANN indexes, loaded with the models they are queried with
+        annoy_path = artifact_path(st.MODEL_ANNOY_INDEX, root)
+        bundle.indexes.register(
+            ITEM2VEC_INDEX,
+            annoy_path,
+            annoy_indexer_loader(bundle.wv),
+            watch=annoy_path + ".d"
+        )
+        bundle.indexes.register(
+            FEATURE_BASED_INDEX,
+            artifact_path(st.MODEL_ANNOY_INDEX_FB, root),
+            annoy_loader(st.DIMS)
+        )
+        return bundle
+
+    def served(self):
+        """:return set: names of the models and indexes loaded"""
+        names = {
+            name for name in ("wv", "neighbors", "fb_model", "fb_embs")
+            if getattr(self, name) is not None
+        }
+        names.update(
+            name for name in (ITEM2VEC_INDEX, FEATURE_BASED_INDEX)
+            if self.indexes.get(name) is not None
+        )
+        return names
+
+    def warmup(self, n_queries=WARMUP_QUERIES, seed=0):
+        """Query every model, so its pages are read before serving"""
+        start_ = time.time()
+        rng = np.random.RandomState(seed)
+
+        if self.wv is not None and len(self.wv.index2word) > 0:
+            self.wv.init_sims()
+            annoy_index = self.indexes.get(ITEM2VEC_INDEX)
+            words = rng.choice(
+                self.wv.index2word,
+                min(n_queries, len(self.wv.index2word)),
+                replace=False
+            )
+            for word in words:
+                if self.neighbors is not None:
+                    self.neighbors.most_similar(word)
+                if annoy_index is not None:
+                    annoy_index.most_similar(
+                        self.wv.vectors_norm[self.wv.vocab[word].index], 21
+                    )
+
+        fb_index = self.indexes.get(FEATURE_BASED_INDEX)
+        fb_embs = self.fb_embs
+        if fb_index is not None and fb_embs is not None and len(fb_embs):
+            rows = rng.choice(
+                len(fb_embs), min(n_queries, len(fb_embs)), replace=False
+            )
+            for row in rows:
+                fb_index.get_nns_by_vector(fb_embs.embs[row], 21)
+
+        logging.info(
+            "Warmup models :: version:%s - queries:%d - took:%.2f's",
+            self.version, n_queries, time.time() - start_
+        )
+        return self
+
+
+class ModelManager:
+    """
+    Current `ModelBundle` of the process
+
+    A thread follows `MODEL_CURRENT_PATH`: a new version is loaded and
+    warmed up in the background, then replaces the current bundle by a
+    single reference assignment. Requests already running keep the old
+    bundle until they return. A version missing any model or index the
+    current bundle serves is never swapped in.
+    """
+
+    def __init__(self,
+                 check_interval=MODEL_CHECK_INTERVAL,
+                 n_warmup=WARMUP_QUERIES):
+        self.check_interval = check_interval
+        self.n_warmup = n_warmup
+        self._current = None
+        self._failed = None
+        self._thread = None
+
+    @property
+    def current(self):
+        return self._current
+
+    @property
+    def version(self):
+        bundle = self._current
+        return bundle.version if bundle is not None else "0"
+
+    def load(self):
+        root = current_version_dir()
+        version = os.path.basename(root) if root else read_version()
+        self._current = ModelBundle.load(version, root)
+        return self
+
+    def check(self):
+        """:return bool: whether a new version was swapped in"""
+        root = current_version_dir()
+        if root is None:
+            return False
+        version = os.path.basename(root)
+        if version in (self.version, self._failed):
+            return False
+
+        start_ = time.time()
+        bundle = ModelBundle.load(version, root)
+        current = self._current
+        missing = set()
+        if current is not None:
+            missing = current.served() - bundle.served()
+        if missing:
+            # keep serving the old version rather than errors
+            logging.error(
+                "Incomplete models :: version:%s - missing:%s",
+                version, ",".join(sorted(missing))
+            )
+            self._failed = version
+            return False
+        bundle.warmup(self.n_warmup)
+
+        self._current = bundle
+        logging.info(
+            "Swap models :: %s -> %s - took:%.2f's",
+            current.version if current is not None else None,
+            version, time.time() - start_
+        )
+        return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+
+        def run():
+            while True:
+                time.sleep(self.check_interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    logging.exception(e)
+
+        self._thread = threading.Thread(
+            target=run, name="model-manager", daemon=True
+        )
+        self._thread.start()
+        return self
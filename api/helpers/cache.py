@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from django.conf import settings as st
+from django.core.cache import caches
+
+
+RESULT_CACHE_SIZE = getattr(st, "RESULT_CACHE_SIZE", 10000)
+RESULT_CACHE_TTL = getattr(st, "RESULT_CACHE_TTL", 600)
+# alias of a django cache shared by the workers, e.g. a FileBasedCache
+RESULT_CACHE_ALIAS = getattr(st, "RESULT_CACHE_ALIAS", None)
+
+
+class ResultCache:
+    """
+    LRU cache of recommendation results with size and TTL bounds,
+    optionally backed by a django cache shared across workers
+
+    Callers put the version of the `ModelBundle` that computed a result
+    in its key: a result is never served under another version, and
+    entries of older versions age out of the LRU.
+    """
+
+    def __init__(self,
+                 maxsize=RESULT_CACHE_SIZE,
+                 ttl=RESULT_CACHE_TTL,
+                 alias=RESULT_CACHE_ALIAS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.alias = alias
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def make_key(self, *parts):
+        return ":".join(str(part) for part in parts)
+
+    def get(self, *parts):
+        key = self.make_key(*parts)
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+
+        value = None
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logging.exception(e)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.shared_hits += 1
+        self._set_local(key, value, now)
+        return value
+
+    def set(self, value, *parts):
+        key = self.make_key(*parts)
+        self._set_local(key, value, time.time())
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                logging.exception(e)
+
+    def _set_local(self, key, value, now):
+        with self._lock:
+            self._data[key] = (now + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+        }
@@ -11,6 +11,23 @@ from gensim.parsing.preprocessing import (
 from pyvi import ViTokenizer
 
 
+# compiled once, used by `preprocess_text_v2`
+RE_LINKS = re.compile(r"http\S+")
+RE_EMAILS = re.compile(r"\S*@\S*\s?")
+RE_SPECIAL_TAGS = re.compile(r"{.*?}")
+RE_MULTIPLE_SPACE = re.compile(r"\s\s+")
+# `split_alphanum` then `strip_numeric`: a digit run next to a letter
+# becomes a separator, any other digit run is dropped
+RE_DIGITS_NEXT_ALPHA = re.compile(r"(?<=[a-z])[0-9]+|[0-9]+(?=[a-z])")
+RE_DIGITS = re.compile(r"[0-9]+")
+# `strip_non_alphanum` then split on spaces
+RE_WORDS = re.compile(r"\w+")
+PUNCTUATION_TABLE = str.maketrans({key: None for key in string.punctuation})
+# salt of the text cache keys: bump on any change of the output of
+# `preprocess_text_v2`, its patterns or the tokenizer (pyvi) version
+PREPROCESS_VERSION = 1
+
+
 def parse_html(text, parser="html.parser"):
     soup = BeautifulSoup(text, parser)
     soup = remove_html_tags(soup)
@@ -67,6 +84,34 @@ def preprocess_text(text):
     return text
 
 
+def preprocess_text_v2(text):
+    """
+    Same output as `preprocess_text`, with precompiled patterns,
+    fused digit/word passes and no html parsing of plain text
+    """
+    if not text:
+        text = ""
+    # only markup and entities are changed by the html parser
+    if "<" in text or "&" in text:
+        text = parse_html_v2(text)
+    else:
+        text = RE_MULTIPLE_SPACE.sub(" ", text)
+    text = text.lower()
+    # NOTE: order matters, removing one may create or break the next match
+    text = RE_LINKS.sub("", text)
+    text = RE_EMAILS.sub("", text)
+    text = RE_SPECIAL_TAGS.sub("", text)
+    text = text.translate(PUNCTUATION_TABLE)
+    text = RE_DIGITS_NEXT_ALPHA.sub(" ", text)
+    text = RE_DIGITS.sub("", text)
+    # words are joined by one space, nothing left to collapse or strip
+    text = " ".join(
+        word for word in RE_WORDS.findall(text) if len(word) >= 2
+    )
+    text = ViTokenizer.tokenize(text)
+    return text
+
+
 def remove_multiple_space(text):
     return re.sub("\s\s+", " ", text)  # noqa
 
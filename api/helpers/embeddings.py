@@ -0,0 +1,160 @@
+import logging
+import os
+
+from django.conf import settings as st
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from api.helpers.utils import save_atomic
+
+
+FB_EMBEDDINGS_KEY = getattr(
+    st, "FB_EMBEDDINGS_KEY", "{}_embs".format(st.FEATURE_BASED_KEY)
+)
+MODEL_FB_EMBEDDINGS = getattr(
+    st, "MODEL_FB_EMBEDDINGS", os.path.join(st.BASE_MODEL, FB_EMBEDDINGS_KEY)
+)
+
+
+def embedding_paths(prefix):
+    return prefix + ".embs.npy", prefix + ".ids.npy"
+
+
+def _save_ids(ids):
+    def save(fpath):
+        # a file object: `np.save` would add `.npy` to the path
+        with open(fpath, "wb") as f:
+            np.save(f, np.asarray(ids, dtype=np.int64))
+    return save
+
+
+def save_embeddings(ids, embs, prefix=MODEL_FB_EMBEDDINGS):
+    """
+    Save the feature-based embedding of every room as a float32 matrix
+    and the room id of each row. The ids file is written last.
+    """
+    embs_path, ids_path = embedding_paths(prefix)
+
+    def save(fpath):
+        out = open_memmap(
+            fpath, mode="w+", dtype=np.float32, shape=embs.shape
+        )
+        out[:] = embs
+        out.flush()
+
+    save_atomic(save, embs_path)
+    save_atomic(_save_ids(ids), ids_path)
+    logging.info(
+        "Save embeddings :: rooms:%d - dims:%d - path:%s",
+        embs.shape[0], embs.shape[1], embs_path
+    )
+    return embs_path, ids_path
+
+
+class EmbeddingWriter:
+    """
+    Append embeddings chunk by chunk to disk, then publish them as
+    `save_embeddings` does, without holding the whole matrix in memory
+    """
+
+    def __init__(self, prefix=MODEL_FB_EMBEDDINGS, chunk_size=10000):
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        # not `<embs>.tmp.*`, taken for a file of the `.tmp` save
+        self.raw_path = embedding_paths(prefix)[0] + ".raw.tmp"
+        self.dims = None
+        self.ids = []
+        self._file = open(self.raw_path, "wb")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, ids, embs):
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+        if self.dims is None:
+            self.dims = embs.shape[1]
+        self._file.write(embs.tobytes())
+        self.ids.extend(int(room_id) for room_id in ids)
+
+    def close(self):
+        """:return tuple: published (embs, ids) paths"""
+        self._file.close()
+        if not self.ids:
+            os.remove(self.raw_path)
+            raise ValueError("No embeddings to save")
+
+        embs_path, ids_path = embedding_paths(self.prefix)
+        shape = (len(self.ids), self.dims)
+        raw = np.memmap(
+            self.raw_path, dtype=np.float32, mode="r", shape=shape
+        )
+
+        def save(fpath):
+            out = open_memmap(
+                fpath, mode="w+", dtype=np.float32, shape=shape
+            )
+            # sequential copy, adds the `.npy` header
+            for start in range(0, shape[0], self.chunk_size):
+                out[start:start + self.chunk_size] = \
+                    raw[start:start + self.chunk_size]
+            out.flush()
+
+        save_atomic(save, embs_path)
+        del raw
+        os.remove(self.raw_path)
+        save_atomic(_save_ids(self.ids), ids_path)
+        logging.info(
+            "Save embeddings :: rooms:%d - dims:%d - path:%s",
+            shape[0], shape[1], embs_path
+        )
+        return embs_path, ids_path
+
+
+class EmbeddingTable:
+    """Memory-mapped room embeddings with a room id -> row lookup"""
+
+    def __init__(self, ids, embs):
+        if len(ids) != len(embs):
+            raise ValueError(
+                "Embeddings do not match their ids: %d != %d rows" % (
+                    len(embs), len(ids)
+                )
+            )
+        self.ids = ids
+        self.embs = embs
+        self._order = np.argsort(ids, kind="mergesort")
+        self._sorted_ids = ids[self._order]
+
+    @classmethod
+    def load(cls, prefix=MODEL_FB_EMBEDDINGS):
+        embs_path, ids_path = embedding_paths(prefix)
+        return cls(np.load(ids_path), np.load(embs_path, mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, room_id):
+        return self.rows([room_id])[1][0]
+
+    def rows(self, room_ids):
+        """
+        :return (rows, found): row of each room id and a mask of
+            the room ids existed in the table
+        """
+        room_ids = np.asarray(room_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return (
+                np.zeros(len(room_ids), dtype=np.int64),
+                np.zeros(len(room_ids), dtype=bool)
+            )
+        pos = np.searchsorted(self._sorted_ids, room_ids)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        found = self._sorted_ids[pos] == room_ids
+        return self._order[pos], found
+
+    def get(self, room_id):
+        """:return array: embedding of the room, or None"""
+        rows, found = self.rows([int(room_id)])
+        if not found[0]:
+            return None
+        return np.asarray(self.embs[rows[0]])
@@ -0,0 +1,60 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lat, long, lats, longs):
+    """Great-circle distances (km) from one point to many points
+
+    :param lat float: latitude of the reference point
+    :param long float: longitude of the reference point
+    :param lats array: latitudes of the candidate points
+    :param longs array: longitudes of the candidate points
+    """
+    lat, long = np.radians(lat), np.radians(long)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    longs = np.radians(np.asarray(longs, dtype=np.float64))
+
+    a = np.sin((lats - lat) / 2.0) ** 2 + \
+        np.cos(lat) * np.cos(lats) * np.sin((longs - long) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def unit_vectors(lats, longs):
+    """(n, 3) points on the unit sphere, chord lengths follow distances"""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    longs = np.radians(np.asarray(longs, dtype=np.float64))
+    return np.column_stack([
+        np.cos(lats) * np.cos(longs),
+        np.cos(lats) * np.sin(longs),
+        np.sin(lats)
+    ])
+
+
+def chord_length(radius_km):
+    """Straight-line distance on the unit sphere of a great-circle one"""
+    angle = min(radius_km / EARTH_RADIUS_KM, np.pi)
+    return 2.0 * np.sin(angle / 2.0)
+
+
+class GeoIndex:
+    """KD-tree of rooms on the unit sphere, for radius queries"""
+
+    def __init__(self, ids, lats, longs):
+        known = ~(np.isnan(lats) | np.isnan(longs))
+        self.ids = ids[known]
+        self.tree = cKDTree(unit_vectors(lats[known], longs[known]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def within(self, lat, long, radius_km):
+        """:return array: ids of the rooms within `radius_km` of a point"""
+        if len(self.ids) == 0:
+            return self.ids
+        rows = self.tree.query_ball_point(
+            unit_vectors([lat], [long])[0], chord_length(radius_km)
+        )
+        return self.ids[np.asarray(rows, dtype=np.int64)]
@@ -1,20 +1,33 @@
+from array import array
 import datetime
+import json
 import os
 import gc
 import logging
 import time
-import sys
 
 from django.conf import settings as st
 from gensim.models import Word2Vec
 from gensim.models.callbacks import CallbackAny2Vec
-from gensim.similarities.index import AnnoyIndexer
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from api import col
+from api import log_scan_col
+from api.helpers.ann_builder import build_item2vec_indexer
+from api.helpers.artifacts import (
+    MODEL_KEYED_VECTORS,
+    artifact_path,
+    save_keyed_vectors
+)
+from api.helpers.neighbors import (
+    NEIGHBORS_KEY,
+    build_neighbor_table,
+    update_neighbor_table
+)
 from api.helpers.utils import (
-    mem_use
+    mem_use,
+    save_atomic
 )
 
 
@@ -37,56 +50,270 @@ def filter_sessions(df, max_=11, min_=3):
     return result
 
 
-def make_df():
+INGEST_BATCH_SIZE = getattr(st, "INGEST_BATCH_SIZE", 10000)
+CORPUS_PATH = getattr(
+    st, "CORPUS_PATH",
+    os.path.join(st.BASE_MODEL, "{}.corpus.txt".format(st.ITEM2VEC_KEY))
+)
+WATERMARK_PATH = getattr(
+    st, "WATERMARK_PATH",
+    os.path.join(st.BASE_MODEL, "{}.watermark.json".format(st.ITEM2VEC_KEY))
+)
+# a session without new clicks for SESSION_GAP seconds is closed
+SESSION_GAP = getattr(st, "SESSION_GAP", 1800)
+COMPACT_CORPUS_PATH = getattr(
+    st, "COMPACT_CORPUS_PATH",
+    os.path.join(st.BASE_MODEL, "{}.corpus".format(st.ITEM2VEC_KEY))
+)
 
-    columns = ["custom_session_id", "room_id"]
 
+def log_query(days_before=st.DAYS_BEFORE):
     days_before = datetime.datetime.now() - \
-        datetime.timedelta(days=st.DAYS_BEFORE)
-    cur = col.find(
-        {"$and": [
-            {"room_id": {"$ne": None}},
-            {"room.status": "Listed"},
-            {"created_at": {"$gte": days_before}}
-        ]},
-        {"custom_session_id": 1, "room_id": 1, "_id": 0}
+        datetime.timedelta(days=days_before)
+    return {"$and": [
+        {"room_id": {"$ne": None}},
+        {"room.status": "Listed"},
+        {"created_at": {"$gte": days_before}}
+    ]}
+
+
+def make_df():
+
+    columns = ["custom_session_id", "room_id", "created_at"]
+
+    cur = log_scan_col.find(
+        log_query(),
+        {"custom_session_id": 1, "room_id": 1, "created_at": 1, "_id": 0}
     )
-    df = pd.DataFrame(list(cur))
-    df.columns = columns
+    df = pd.DataFrame(list(cur), columns=columns)
     mem_use(df)
 
     return df
 
 
-def make_samples(df, sessions, total_mem_use=1000):
+def drop_open_sessions(df, closed_before):
+    """Keep logs of sessions whose last click is before `closed_before`"""
+    last = df.groupby("custom_session_id")["created_at"].transform("max")
+    return df[(last < closed_before).values]
+
+
+def group_sorted(cur):
+    """Room ids of each session, from logs sorted by session"""
+    session_id, room_ids = None, []
+    for doc in cur:
+        if doc["custom_session_id"] != session_id:
+            if room_ids:
+                yield room_ids
+            session_id, room_ids = doc["custom_session_id"], []
+        room_ids.append(doc["room_id"])
+    if room_ids:
+        yield room_ids
+
+
+def stream_sessions(query=None,
+                    max_=None,
+                    min_=None,
+                    batch_size=INGEST_BATCH_SIZE,
+                    window=None):
     """
-    :param df: dataframe to fetch data from mongo's collection,
-            included: custom_session_id, room_id
-    :param sessions: sessions after filter on range, (index, values)
-    :param total_mem_use: max memory used to store session data,
-            default to 1000MB
+    Read logs in batches sorted by session, then by click order,
+    and yield each session as soon as it is closed
+
+    Only one session is held in memory at a time.
+
+    :param window: only sessions closed in `window`, each read in full,
+        see `closed_window`
+    :return generator: sessions of room ids as string tokens
     """
-    session_data = []
-    index = 0
+    if query is None:
+        query = log_query()
+
+    pipeline = [
+        {"$match": {"$and": [
+            query, {"custom_session_id": {"$ne": None}}
+        ]}},
+        {"$sort": {"custom_session_id": 1, "_id": 1}},
+    ]
+    if window is not None:
+        # filter on the last click of the whole session, not on each log
+        last = {"$lt": window["closed_before"]}
+        if window.get("closed_after") is not None:
+            last["$gte"] = window["closed_after"]
+        pipeline += [
+            {"$group": {
+                "_id": "$custom_session_id",
+                "room_ids": {"$push": "$room_id"},
+                "last": {"$max": "$created_at"},
+            }},
+            {"$match": {"last": last}},
+            {"$project": {"room_ids": 1}},
+        ]
+    else:
+        pipeline.insert(
+            1, {"$project": {"custom_session_id": 1, "room_id": 1}}
+        )
+
+    cur = log_scan_col.aggregate(
+        pipeline, allowDiskUse=True, batchSize=batch_size
+    )
+    if window is not None:
+        sessions = (doc["room_ids"] for doc in cur)
+    else:
+        sessions = group_sorted(cur)
 
-    # make initial data
-    # very SLOWLY interation
-    for k, v in tqdm(zip(sessions.index, sessions.values),
-                     total=len(sessions)):
+    for room_ids in sessions:
+        if max_ is not None and len(room_ids) > max_:
+            continue
+        if min_ is not None and len(room_ids) < min_:
+            continue
         # NOTE: must be convert to string
-        session_data.append(list(filter_rooms(df, k).values.astype(str)))
+        yield [str(int(room_id)) for room_id in room_ids]
+
 
-        cur_memory_use = sys.getsizeof(session_data) // 1024
-        index += 1
-        if index == 1000:
-            logging.info("Get size of: %d MB", cur_memory_use)
-            if cur_memory_use >= total_mem_use:
-                return session_data
-            index = 0
+def write_line_corpus(sessions, fpath=CORPUS_PATH):
+    """
+    Write sessions to a text corpus, one space separated session per line,
+    which gensim reads back with `corpus_file`
+
+    :return (no_sessions, no_words):
+    """
+    no_sessions, no_words = 0, 0
+    tmp_path = fpath + ".tmp"
+    with open(tmp_path, "w") as f:
+        for session in sessions:
+            f.write(" ".join(session))
+            f.write("\n")
+            no_sessions += 1
+            no_words += len(session)
+    os.replace(tmp_path, fpath)
+
+    logging.info(
+        "Write corpus :: sessions:%d - words:%d - path:%s",
+        no_sessions, no_words, fpath
+    )
+    return no_sessions, no_words
+
+
+WATERMARK_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def load_watermark(fpath=WATERMARK_PATH):
+    """:return dict: `closed_before` of the last trained window"""
+    try:
+        with open(fpath) as f:
+            watermark = json.load(f)
+        return {
+            "closed_before": datetime.datetime.strptime(
+                watermark["closed_before"], WATERMARK_FMT
+            ),
+        }
+    except (OSError, KeyError, ValueError):
+        # missing, or written by an older version: full training
+        return None
+
+
+def save_watermark(window, fpath=WATERMARK_PATH):
+    tmp_path = fpath + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "closed_before": window["closed_before"].strftime(WATERMARK_FMT),
+        }, f)
+    os.replace(tmp_path, fpath)
+    logging.info(
+        "Save watermark :: closed_before:%s", window["closed_before"]
+    )
+
+
+def newest_log(query=None):
+    """:return datetime: `created_at` of the newest log, None if none"""
+    doc = log_scan_col.find_one(
+        query if query is not None else log_query(),
+        {"created_at": 1, "_id": 0},
+        sort=[("created_at", -1)]
+    )
+    return doc["created_at"] if doc else None
+
+
+def closed_window(watermark=None, newest=None, session_gap=SESSION_GAP):
+    """
+    Sessions closed since `watermark`: their last click is after the
+    previous window and more than `session_gap` seconds before the
+    newest log, so each session is trained once, in full
+
+    The window follows the logs, not the clock of this host: mongo
+    dates are naive UTC.
+
+    :param newest: `created_at` of the newest log, default to `newest_log`
+    :return dict: `closed_after` (None for every closed session) and
+        `closed_before`, see `stream_sessions`
+    """
+    closed_after = watermark["closed_before"] if watermark else None
+    if newest is None:
+        newest = newest_log()
+    if newest is None:
+        # no log at all
+        newest = datetime.datetime.utcnow()
+    closed_before = newest - datetime.timedelta(seconds=session_gap)
+    if closed_after is not None:
+        # never moves back, an empty window keeps the watermark
+        closed_before = max(closed_before, closed_after)
+    return {"closed_after": closed_after, "closed_before": closed_before}
+
+
+def split_sessions(df, sessions=None, max_=None, min_=None):
+    """
+    Group click logs into sessions with a single stable sort,
+    O(rows log rows) instead of one `isin` scan per session
+
+    :param df: dataframe included: custom_session_id, room_id
+    :param sessions: only keep these sessions (index of `filter_sessions`)
+    :param max_, min_: only keep sessions with min_ <= no items <= max_
+    :return list: sessions of room ids as string tokens, in click order
+    """
+    if len(df) == 0:
+        return []
+
+    # NOTE: must be convert to string
+    room_ids = df["room_id"].values.astype(int).astype(str)
+    codes, uniques = pd.factorize(df["custom_session_id"])
+
+    # stable sort keeps click order inside each session
+    order = np.argsort(codes, kind="mergesort")
+    codes, room_ids = codes[order], room_ids[order]
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    counts = ends - starts
+
+    # code -1 is a missing session id
+    keep = codes[starts] != -1
+    if sessions is not None:
+        keep &= np.isin(
+            np.asarray(uniques, dtype=object)[codes[starts]],
+            np.asarray(sessions.index, dtype=object)
+        )
+    if max_ is not None:
+        keep &= counts <= max_
+    if min_ is not None:
+        keep &= counts >= min_
+
+    return [
+        room_ids[start:end].tolist()
+        for start, end in zip(starts[keep], ends[keep])
+    ]
+
+
+def make_samples(df, sessions):
+    """
+    :param df: dataframe to fetch data from mongo's collection,
+            included: custom_session_id, room_id
+    :param sessions: sessions after filter on range, (index, values)
+    """
+    session_data = split_sessions(df, sessions)
+    logging.info("No sessions: %d", len(session_data))
 
     del df
     gc.collect()
-    time.sleep(5)
     return session_data
 
 
@@ -95,9 +322,8 @@ def filter_rooms(df, session_id):
 
 
 def gen_sessions(df, sessions):
-    for k, v in zip(sessions.index, sessions.values):
-        # NOTE: must be convert to string
-        yield list(filter_rooms(df, k).values.astype(str))
+    for session in split_sessions(df, sessions):
+        yield session
 
 
 class RoomsGenerator:
@@ -108,17 +334,115 @@ class RoomsGenerator:
     def __init__(self, df, sessions):
         self.df = df
         self.sessions = sessions
+        self._samples = None
+
+    @property
+    def samples(self):
+        # sessions are split once, then reused on every epoch
+        if self._samples is None:
+            self._samples = split_sessions(self.df, self.sessions)
+        return self._samples
 
     def __iter__(self):
-        for k, v in tqdm(zip(self.sessions.index, self.sessions.values),
-                         total=len(self.sessions)):
-            # NOTE: must be convert to string
-            yield list(filter_rooms(self.df, k).values.astype(str))
+        for session in tqdm(self.samples, total=len(self.samples)):
+            yield session
 
     def __len__(self):
         return len(self.sessions)
 
 
+class SessionCorpus:
+    """
+    Integer-encoded sessions: a flat int32 `tokens` array, int64 `offsets`
+    (session i is tokens[offsets[i]:offsets[i + 1]]) and `vocab`, the room id
+    of each token. Saved as `.npy` files and memory-mapped on load.
+    """
+
+    def __init__(self, tokens, offsets, vocab):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.vocab = vocab
+        self._words = None
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        """
+        :param sessions: iterable of sessions of room ids (int or str),
+            consumed once, e.g. `stream_sessions()`
+        """
+        token_of = {}
+        tokens, offsets = array("i"), array("q", [0])
+        for session in sessions:
+            for room_id in session:
+                room_id = int(room_id)
+                token = token_of.get(room_id)
+                if token is None:
+                    token = token_of[room_id] = len(token_of)
+                tokens.append(token)
+            offsets.append(len(tokens))
+
+        vocab = np.empty(len(token_of), dtype=np.int64)
+        for room_id, token in token_of.items():
+            vocab[token] = room_id
+
+        return cls(
+            np.frombuffer(tokens, dtype=np.int32),
+            np.frombuffer(offsets, dtype=np.int64),
+            vocab
+        )
+
+    @staticmethod
+    def paths(prefix):
+        return {
+            "tokens": prefix + ".tokens.npy",
+            "offsets": prefix + ".offsets.npy",
+            "vocab": prefix + ".vocab.npy",
+        }
+
+    def save(self, prefix=COMPACT_CORPUS_PATH):
+        paths = self.paths(prefix)
+        for name, fpath in paths.items():
+            np.save(fpath, getattr(self, name))
+        logging.info(
+            "Save corpus :: sessions:%d - words:%d - rooms:%d - size:%.1fMB",
+            len(self), self.total_words, len(self.vocab),
+            sum(os.path.getsize(fpath) for fpath in paths.values()) / 1024 ** 2
+        )
+        return self
+
+    @classmethod
+    def load(cls, prefix=COMPACT_CORPUS_PATH, mmap_mode="r"):
+        paths = cls.paths(prefix)
+        return cls(
+            np.load(paths["tokens"], mmap_mode=mmap_mode),
+            np.load(paths["offsets"], mmap_mode=mmap_mode),
+            np.load(paths["vocab"])
+        )
+
+    @property
+    def total_words(self):
+        return len(self.tokens)
+
+    @property
+    def words(self):
+        # one string per room, shared by every sentence
+        if self._words is None:
+            self._words = [str(room_id) for room_id in self.vocab.tolist()]
+        return self._words
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        words = self.words
+        offsets = self.offsets
+        for i in range(len(self)):
+            yield [
+                words[token]
+                for token in self.tokens[offsets[i]:offsets[i + 1]].tolist()
+            ]
+
+
 class Timer(CallbackAny2Vec):
 
     def __init__(self, start):
@@ -128,16 +452,19 @@ class Timer(CallbackAny2Vec):
         logging.info("Take %d's'", time.time() - self.start)
 
 
-def train_item2vec(df=None, sessions=None, samples=None):
-    if df is None and samples is None:
+def train_item2vec(df=None, sessions=None, samples=None, corpus_file=None):
+    if df is None and samples is None and corpus_file is None:
         raise NotImplementedError(
-            ">>> Must be specific no items. Can not set `df` and `samples` to None"  # noqa
+            ">>> Must be specific no items. Can not set `df`, `samples` and `corpus_file` to None"  # noqa
         )
 
-    if samples is None:
-        gen_rooms = RoomsGenerator(df, sessions)
+    if corpus_file is not None:
+        # stream sessions from disk, see `write_line_corpus`
+        corpus = {"corpus_file": corpus_file}
+    elif samples is None:
+        corpus = {"sentences": RoomsGenerator(df, sessions)}
     else:
-        gen_rooms = samples
+        corpus = {"sentences": samples}
 
     start_ = time.time()
     model_i2v_path = os.path.join(
@@ -149,13 +476,14 @@ def train_item2vec(df=None, sessions=None, samples=None):
         model = Word2Vec.load(model_i2v_path)
         logging.info("Vocabulary before re-training: %d", len(model.wv.vocab))
 
-        model.build_vocab(gen_rooms, update=True)
+        model.build_vocab(update=True, **corpus)
         logging.info("Vocabulary after re-training: %d", len(model.wv.vocab))
         model.train(
-            gen_rooms,
             total_examples=model.corpus_count,
+            total_words=model.corpus_total_words,
             epochs=model.iter,
-            callbacks=()
+            callbacks=(),
+            **corpus
         )
         logging.info(
             "Pre-train model took %d's'",
@@ -163,7 +491,6 @@ def train_item2vec(df=None, sessions=None, samples=None):
         )
     else:
         model = Word2Vec(
-            gen_rooms,
             sg=st.SG,
             size=st.I2V_DIM,
             window=st.WINDOWS,
@@ -173,17 +500,109 @@ def train_item2vec(df=None, sessions=None, samples=None):
             sample=st.SAMPLE,
             negative=st.NS,
             compute_loss=st.COMPUTE_LOSS,
-            callbacks=[Timer(start_)]
+            callbacks=[Timer(start_)],
+            **corpus
         )
 
+    save_item2vec(model)
+    return model
+
+
+def save_item2vec(model, rows=None):
+    """
+    Save the model, its annoy index and neighbor table
+
+    :param rows: vocabulary rows changed by an incremental retrain,
+        only their neighbors are recomputed. Default to all rooms
+    """
     logging.info("Saving item2vec model")
-    model.save(model_i2v_path)
+    # the file is hard-linked by published versions, replace it
+    save_atomic(
+        model.save,
+        os.path.join(
+            st.BASE_MODEL,
+            "{}.model".format(st.ITEM2VEC_KEY)
+        )
+    )
 
+    # vectors only, memory-mapped by the API workers
+    save_keyed_vectors(
+        model.wv, artifact_path(MODEL_KEYED_VECTORS, st.BASE_MODEL)
+    )
+
+    # NOTE: a built annoy index is immutable, always rebuilt
     logging.info("Build annoy index for item2vec model")
-    annoy_index = AnnoyIndexer(model, 100)
-    annoy_index.save(
+    build_item2vec_indexer(
+        model,
         os.path.join(
             st.BASE_MODEL,
             "{}.model".format(st.ANNOY_INDEX_KEY)
         )
     )
+
+    neighbors_path = os.path.join(st.BASE_MODEL, NEIGHBORS_KEY)
+    if rows is None:
+        logging.info("Build top-K neighbor table for item2vec model")
+        build_neighbor_table(model.wv, neighbors_path)
+    else:
+        logging.info("Update top-K neighbor table for item2vec model")
+        update_neighbor_table(model.wv, rows, neighbors_path)
+
+
+def train_item2vec_incremental(watermark_path=WATERMARK_PATH):
+    """
+    Retrain the saved model on sessions closed since the last run only
+
+    Fallback to a full training on the whole window when there is no
+    saved model or watermark yet.
+
+    :return int: no new sessions trained on
+    """
+    model_i2v_path = os.path.join(
+        st.BASE_MODEL,
+        "{}.model".format(st.ITEM2VEC_KEY)
+    )
+    watermark = load_watermark(watermark_path)
+    full = watermark is None or not os.path.exists(model_i2v_path)
+    if full:
+        logging.info("No watermark or model, make a full training")
+        watermark = None
+    window = closed_window(watermark)
+    corpus = SessionCorpus.from_sessions(stream_sessions(
+        max_=st.MAX_CLICK, min_=st.MIN_CLICK, window=window
+    ))
+
+    if full:
+        train_item2vec(samples=corpus)
+    elif len(corpus) == 0:
+        logging.info(
+            "No new sessions since %s", watermark["closed_before"]
+        )
+    else:
+        start_ = time.time()
+        model = Word2Vec.load(model_i2v_path)
+        no_vocab = len(model.wv.vocab)
+        model.build_vocab(corpus, update=True)
+
+        # training cost follows the new sessions, not the window size
+        model.train(
+            corpus,
+            total_examples=len(corpus),
+            total_words=corpus.total_words,
+            epochs=model.iter
+        )
+        logging.info(
+            "Incremental training :: sessions:%d - new rooms:%d - took:%d's",
+            len(corpus), len(model.wv.vocab) - no_vocab,
+            time.time() - start_
+        )
+
+        rows = [
+            model.wv.vocab[word].index
+            for word in corpus.words if word in model.wv.vocab
+        ]
+        save_item2vec(model, rows=rows)
+
+    # only once the model is saved, a failed run is retried
+    save_watermark(window, watermark_path)
+    return len(corpus)
@@ -0,0 +1,207 @@
+import logging
+import os
+import time
+
+from django.conf import settings as st
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from api.helpers.utils import save_atomic
+
+
+NEIGHBORS_KEY = getattr(st, "NEIGHBORS_KEY", "item2vec_neighbors")
+NEIGHBORS_TOPK = getattr(st, "NEIGHBORS_TOPK", 50)
+NEIGHBORS_BLOCK = getattr(st, "NEIGHBORS_BLOCK", 256)
+MODEL_NEIGHBORS = getattr(
+    st, "MODEL_NEIGHBORS", os.path.join(st.BASE_MODEL, NEIGHBORS_KEY)
+)
+
+
+def neighbor_paths(prefix):
+    return prefix + ".ids.npy", prefix + ".sims.npy"
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(sims, k):
+    """Indices and values of the k largest entries of each row, sorted"""
+    idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(sims, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind="mergesort")
+    return (
+        np.take_along_axis(idx, order, axis=1),
+        np.take_along_axis(vals, order, axis=1)
+    )
+
+
+def most_similar_rows(matrix,
+                      queries,
+                      topn,
+                      exclude=None,
+                      block_size=NEIGHBORS_BLOCK):
+    """
+    Exact top-N rows of `matrix` by dot product for many queries at once
+
+    :param exclude: for each query, rows never returned (e.g. itself)
+    :return (rows, sims): (n_queries, topn) arrays
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    topn = min(topn, matrix.shape[0])
+    rows = np.empty((len(queries), topn), dtype=np.int64)
+    sims = np.empty((len(queries), topn), dtype=np.float32)
+    for start in range(0, len(queries), block_size):
+        block_sims = queries[start:start + block_size] @ matrix.T
+        if exclude is not None:
+            for i, excluded in enumerate(exclude[start:start + block_size]):
+                block_sims[i, excluded] = -np.inf
+        rows[start:start + block_size], sims[start:start + block_size] = \
+            top_k(block_sims, topn)
+    return rows, sims
+
+
+def fill_neighbor_rows(norm, ids, sims, rows, block_size=NEIGHBORS_BLOCK):
+    """Compute top-K neighbors of `rows` in blocks of `block_size` rows"""
+    k = ids.shape[1]
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        block_sims = norm[block] @ norm.T
+        # a room is not its own neighbor
+        block_sims[np.arange(len(block)), block] = -np.inf
+        ids[block], sims[block] = top_k(block_sims, k)
+
+
+def _save_table(prefix, shape, fill):
+    """New (ids, sims) tables of `prefix`, written by `fill(ids, sims)`"""
+    def save(ids_path, sims_path):
+        ids = open_memmap(ids_path, mode="w+", dtype=np.int32, shape=shape)
+        sims = open_memmap(
+            sims_path, mode="w+", dtype=np.float32, shape=shape
+        )
+        fill(ids, sims)
+        ids.flush()
+        sims.flush()
+
+    save_atomic(save, *neighbor_paths(prefix))
+
+
+def build_neighbor_table(wv,
+                         prefix=MODEL_NEIGHBORS,
+                         topk=NEIGHBORS_TOPK,
+                         block_size=NEIGHBORS_BLOCK):
+    """
+    Precompute top-K cosine neighbors of every vocabulary room
+
+    Rows follow `wv.index2word`. Neighbor ids (int32, row indices) and
+    similarities (float32) are written block by block to `.npy` files,
+    which are memory-mapped at serve time.
+    """
+    start_ = time.time()
+    norm = normalize(wv.vectors)
+    topk = min(topk, len(norm) - 1)
+
+    _save_table(
+        prefix, (len(norm), topk),
+        lambda ids, sims: fill_neighbor_rows(
+            norm, ids, sims, np.arange(len(norm)), block_size
+        )
+    )
+
+    logging.info(
+        "Build neighbor table :: rooms:%d - topk:%d - took:%.2f's",
+        len(norm), topk, time.time() - start_
+    )
+    return neighbor_paths(prefix)
+
+
+def update_neighbor_table(wv,
+                          rows,
+                          prefix=MODEL_NEIGHBORS,
+                          topk=NEIGHBORS_TOPK,
+                          block_size=NEIGHBORS_BLOCK):
+    """
+    Recompute the neighbors of `rows` only, e.g. rooms seen in an
+    incremental retrain, keeping the other rows of the current table.
+    Rows added to the vocabulary since the table was built are always
+    computed.
+    """
+    ids_path, sims_path = neighbor_paths(prefix)
+    if not (os.path.exists(ids_path) and os.path.exists(sims_path)):
+        return build_neighbor_table(wv, prefix, topk, block_size)
+
+    start_ = time.time()
+    old_ids = np.load(ids_path, mmap_mode="r")
+    old_sims = np.load(sims_path, mmap_mode="r")
+    norm = normalize(wv.vectors)
+    topk = min(topk, len(norm) - 1)
+    if old_ids.shape[1] != topk or old_ids.shape[0] > len(norm):
+        return build_neighbor_table(wv, prefix, topk, block_size)
+
+    n_old = old_ids.shape[0]
+    rows = np.union1d(
+        np.asarray(rows, dtype=np.int64),
+        np.arange(n_old, len(norm))
+    )
+
+    def fill(ids, sims):
+        ids[:n_old] = old_ids
+        sims[:n_old] = old_sims
+        fill_neighbor_rows(norm, ids, sims, rows, block_size)
+
+    _save_table(prefix, (len(norm), topk), fill)
+    del old_ids, old_sims
+
+    logging.info(
+        "Update neighbor table :: rooms:%d - updated:%d - took:%.2f's",
+        len(norm), len(rows), time.time() - start_
+    )
+    return neighbor_paths(prefix)
+
+
+class NeighborTable:
+    """Memory-mapped top-K neighbor table of an item2vec model"""
+
+    def __init__(self, ids, sims, wv):
+        if ids.shape[0] != len(wv.index2word):
+            raise ValueError(
+                "Neighbor table does not match the model: %d != %d rooms" % (
+                    ids.shape[0], len(wv.index2word)
+                )
+            )
+        self.ids = ids
+        self.sims = sims
+        self.wv = wv
+
+    @classmethod
+    def load(cls, wv, prefix=MODEL_NEIGHBORS):
+        ids_path, sims_path = neighbor_paths(prefix)
+        return cls(
+            np.load(ids_path, mmap_mode="r"),
+            np.load(sims_path, mmap_mode="r"),
+            wv
+        )
+
+    @property
+    def topk(self):
+        return self.ids.shape[1]
+
+    def most_similar(self, word, topn=20):
+        """
+        :return list: (room_id, similarity) of the `topn` nearest rooms,
+            or None when the room or `topn` is not covered by the table
+        """
+        vocab = self.wv.vocab.get(word)
+        if vocab is None or topn > self.topk:
+            return None
+
+        labels = self.wv.index2word
+        return [
+            (labels[j], float(sim))
+            for j, sim in zip(
+                self.ids[vocab.index, :topn], self.sims[vocab.index, :topn]
+            )
+        ]
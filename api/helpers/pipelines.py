@@ -1,9 +1,8 @@
 import os
-import time
 import logging
 
-from annoy import AnnoyIndex
 from django.conf import settings as st
+import numpy as np
 from sklearn.decomposition import TruncatedSVD, PCA
 from sklearn.impute import SimpleImputer
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -15,6 +14,12 @@ from sklearn.preprocessing import (
     Normalizer
 )
 
+from api.helpers.ann_builder import FB_ANNOY_TREES, build_annoy
+from api.helpers.embeddings import (
+    EmbeddingTable,
+    EmbeddingWriter,
+    save_embeddings
+)
 from api.helpers.selectors import FeatureSelector
 from api.helpers.transformers import (
     NumericalTransformer,
@@ -32,6 +37,9 @@ def make_scaler(scaler="standard"):
         return ("minmax", MinMaxScaler())
     elif scaler == "normalize":
         return ("normalize", Normalizer())
+    elif scaler == "sparse_standard":
+        # unit variance without centering, sparse matrices stay sparse
+        return ("standard", StandardScaler(with_mean=False))
 
 
 def make_num_pl(feature_names, strategy="most_frequent", scaler="standard"):
@@ -43,6 +51,7 @@ def make_num_pl(feature_names, strategy="most_frequent", scaler="standard"):
     ]
 
     vec_pipe.append(make_scaler(scaler))
+    vec_pipe.append(("convert_type", ConvertType(np.float32)))
 
     return Pipeline(steps=vec_pipe)
 
@@ -52,21 +61,25 @@ def make_seq_pl(feature_names, dims=64, scaler="standard"):
         # ('simplify', Simplify()),
         ('selector', FeatureSelector(feature_names)),
         ('seq_transformer', SequenceTransformer()),
-        ('tfidf', TfidfVectorizer()),
+        # sparse float32 (rooms x vocabulary), fitted on every room
+        # given, see `make_model_chunked` to fit on a sample
+        ('tfidf', TfidfVectorizer(dtype=np.float32)),
         ('tsvd', TruncatedSVD(n_components=dims)),
     ]
 
     vec_pipe.append(make_scaler(scaler))
+    vec_pipe.append(("convert_type", ConvertType(np.float32)))
 
     return Pipeline(vec_pipe)
 
 
-def make_cate_pl(feature_names, scaler="standard"):
+def make_cate_pl(feature_names, scaler="sparse_standard"):
     vec_pipe = [
         ('selector', FeatureSelector(feature_names)),
         ('seq_transformer', CategoryTransformer()),
-        ('custom_mlb', MultiColumnLabelEncoder()),
-        ('convert_type', ConvertType()),
+        # sparse (rooms x amenities), the union stays sparse
+        ('custom_mlb', MultiColumnLabelEncoder(sparse_output=True)),
+        ('convert_type', ConvertType(np.float32)),
     ]
 
     vec_pipe.append(make_scaler(scaler))
@@ -82,6 +95,7 @@ def make_dr_pineline(dims=32, reducer="tsvd"):
         vec_pipe.append(('pca', PCA(n_components=dims)))
 
     vec_pipe.append(("norm", Normalizer()))
+    vec_pipe.append(("convert_type", ConvertType(np.float32)))
 
     return Pipeline(vec_pipe)
 
@@ -121,20 +135,51 @@ def make_model(rooms, return_model=False):
     embs = full_pl.fit_transform(rooms)
     logging.info(embs.shape)
 
-    # build annoy index
-    t = AnnoyIndex(embs.shape[1])
-    for index, room_id in enumerate(rooms["id"].values):
-        t.add_item(int(room_id), embs[index])
+    # served as a row lookup, no transform at request time
+    save_embeddings(rooms["id"].values, embs)
+
+    logging.info("Build annoy index for feature-based")
+    build_annoy(
+        embs,
+        FB_ANNOY_TREES,
+        ids=rooms["id"].values,
+        fpath=os.path.join(
+            st.BASE_MODEL,
+            "{}.model".format(st.ANNOY_INDEX_FB_KEY)
+        )
+    )
+
+    return full_pl
+
+
+def make_model_chunked(sample, batches):
+    """
+    Out-of-core `make_model`: fit the pipeline on a sample of rooms, then
+    transform `batches` one at a time, embeddings are appended to disk
+
+    :param sample DataFrame: rooms to fit the pipeline on
+    :param batches: iterable of room DataFrames, see `stream_rooms`
+    """
+    full_pl = full_pipeline(return_model=False)
+    full_pl.fit(sample)
+    logging.info("Fit pipeline :: sample:%d", len(sample))
+
+    writer = EmbeddingWriter()
+    for rooms in batches:
+        writer.append(rooms["id"].values, full_pl.transform(rooms))
+        logging.info("Transform rooms :: done:%d", len(writer))
+    writer.close()
 
     logging.info("Build annoy index for feature-based")
-    start_ = time.time()
-    t.build(10)
-    t.save(
-        os.path.join(
+    table = EmbeddingTable.load()
+    build_annoy(
+        table.embs,
+        FB_ANNOY_TREES,
+        ids=table.ids,
+        fpath=os.path.join(
             st.BASE_MODEL,
             "{}.model".format(st.ANNOY_INDEX_FB_KEY)
         )
     )
-    logging.info(">>> Took %d's", round(time.time() - start_, 2))
 
     return full_pl
@@ -1,59 +1,120 @@
-import os
 import logging
 
 from django.conf import settings as st
 import numpy as np
-from geopy.distance import geodesic
-from gensim.similarities.index import AnnoyIndexer
 import pandas as pd
 
-from api.helpers.response_format import json_format
+from api.helpers.ann_builder import ANNOY_SEARCH_K
+from api.helpers.bundle import FEATURE_BASED_INDEX, ITEM2VEC_INDEX
+from api.helpers.geo import haversine
+from api.helpers.neighbors import most_similar_rows, normalize, top_k
+from api.helpers.response_format import dict_format, json_format
+from api.helpers.tracing import span, traced
 from api import (
-    model, fb_model, ann,
-    col, room_col
+    models, col, room_col, room_store, session_index, result_cache
 )
 
 
-def get_indexer(fpath, model, room_id):
-    if os.path.exists(fpath):
-        logging.info("Use annoy_index :: room_id:%s", room_id)
-        annoy_index = AnnoyIndexer()
-        annoy_index.load(fpath)
-        annoy_index.model = model
+# weight of the i-th most recent room of a session, see `session_query`
+SESSION_DECAY = getattr(st, "SESSION_DECAY", 1.0)
+# default radius of `get_room_similar`, None or 0 to search everywhere
+GEO_RADIUS_KM = getattr(st, "GEO_RADIUS_KM", None)
+# most similar rooms filtered by distance before the room store is loaded
+GEO_FALLBACK_TOPN = getattr(st, "GEO_FALLBACK_TOPN", 200)
 
-        return annoy_index
-    else:
-        # indexer: defaut is None
-        return None
 
+def get_indexer(bundle, room_id):
+    annoy_index = bundle.indexes.get(ITEM2VEC_INDEX)
+    if annoy_index is not None:
+        logging.info("Use annoy_index :: room_id:%s", room_id)
+    # indexer: defaut is None
+    return annoy_index
 
-def cal_lat_long_location(col,
-                          main_id,
-                          room_ids,
-                          sort=True,
-                          return_distance=False,
-                          return_sim=False,
-                          reverse=False,
-                          topn=20):
 
-    main_room = col.find({"id": int(main_id)})[0]
-    main_lat_long = (
-        main_room["room_address"]["latitude"],
-        main_room["room_address"]["longitude"]
+def fetch_lat_long(col, room_ids):
+    """
+    Fetch (latitude, longitude) of many rooms with a single `$in` query
+
+    :return dict: room_id (int) -> (latitude, longitude)
+    """
+    cur = col.find(
+        {"id": {"$in": list(room_ids)}},
+        {
+            "id": 1,
+            "room_address.latitude": 1,
+            "room_address.longitude": 1,
+            "_id": 0
+        }
     )
 
-    lat_long_dist = []
-    for room_id, sim in room_ids:
+    lat_long = {}
+    for room_info in cur:
         try:
-            room_info = col.find({"id": int(room_id)})[0]
-            lat_long = (
-                room_info["room_address"]["latitude"],
-                room_info["room_address"]["longitude"]
+            room_id = int(room_info["id"])
+            if room_id in lat_long:
+                continue
+            lat_long[room_id] = (
+                float(room_info["room_address"]["latitude"]),
+                float(room_info["room_address"]["longitude"])
             )
-            dist = geodesic(lat_long, main_lat_long).kilometers
-            lat_long_dist.append((room_id, sim, dist))
-        except Exception:
+        except (KeyError, TypeError, ValueError):
             continue
+    return lat_long
+
+
+@traced("metadata_fetch")
+def lookup_lat_long(col, room_ids):
+    """
+    (latitude, longitude) of rooms from the room store, only rooms
+    created after the last store refresh are fetched from mongo
+
+    :return dict: room_id (int) -> (latitude, longitude)
+    """
+    lat_long = room_store.lat_long(room_ids)
+    missing = room_store.missing(room_ids)
+    if missing:
+        lat_long.update(fetch_lat_long(col, missing))
+    return lat_long
+
+
+@traced("rerank")
+def rerank_by_distance(main_id,
+                       room_ids,
+                       lat_long,
+                       sort=True,
+                       return_distance=False,
+                       return_sim=False,
+                       reverse=False,
+                       topn=20):
+    """
+    :param room_ids: list of (room_id, similarity)
+    :param lat_long dict: coordinates of the main room and the candidates,
+        see `lookup_lat_long`
+    """
+    main_id = int(main_id)
+    if main_id not in lat_long:
+        raise IndexError("Room not found :: room_id:%s" % main_id)
+    main_lat_long = lat_long[main_id]
+
+    # keep rooms with known coordinates, in the original order
+    candidates = []
+    for room_id, sim in room_ids:
+        try:
+            if int(room_id) in lat_long:
+                candidates.append((room_id, sim, int(room_id)))
+        except (TypeError, ValueError):
+            continue
+
+    if candidates:
+        lats, longs = zip(*[lat_long[sample[2]] for sample in candidates])
+        dists = haversine(main_lat_long[0], main_lat_long[1], lats, longs)
+    else:
+        dists = []
+
+    lat_long_dist = [
+        (room_id, sim, float(dist))
+        for (room_id, sim, _), dist in zip(candidates, dists)
+    ]
 
     if sort:
         # sorted by distances
@@ -65,23 +126,96 @@ def cal_lat_long_location(col,
     return lat_long_dist[:topn]
 
 
-def get_room_by_feature_vector(room_id, topn):
+def room_ids_of(room_ids):
+    result = []
+    for room_id, _ in room_ids:
+        try:
+            result.append(int(room_id))
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+def cal_lat_long_location(col,
+                          main_id,
+                          room_ids,
+                          sort=True,
+                          return_distance=False,
+                          return_sim=False,
+                          reverse=False,
+                          topn=20):
+
+    lat_long = lookup_lat_long(col, [int(main_id)] + room_ids_of(room_ids))
+    return rerank_by_distance(
+        main_id, room_ids, lat_long,
+        sort=sort,
+        return_distance=return_distance,
+        return_sim=return_sim,
+        reverse=reverse,
+        topn=topn
+    )
+
+
+@traced("embedding")
+def get_feature_vector(bundle, room_id):
+    fb_embs = bundle.fb_embs
+    if fb_embs is not None:
+        emb = fb_embs.get(room_id)
+        if emb is not None:
+            return emb
+
+    # room added after the last build
     room = pd.DataFrame(list(room_col.find(
         {"id": int(room_id)},
         {fea: 1 for fea in st.TOTAL_FEATURES}.update({"_id": 0})
     )))
     # transform DataFrame to vector embedding
-    emb = fb_model.transform(room)[0]
+    return bundle.fb_model.transform(room)[0]
+
 
-    room_ids = ann.get_nns_by_vector(emb, topn + 1, include_distances=True)
+def get_room_by_feature_vector(bundle, room_id, topn):
+    emb = get_feature_vector(bundle, room_id)
+
+    ann = bundle.indexes.get(FEATURE_BASED_INDEX)
+    with span("ann_query"):
+        room_ids = ann.get_nns_by_vector(
+            emb, topn + 1,
+            search_k=ANNOY_SEARCH_K, include_distances=True
+        )
     return list(zip(room_ids[0], room_ids[1]))[1:]
 
 
+@traced("session_lookup")
 def get_last_room_session(custom_session_id=None,
                           ip_address=None,
                           no_limit=5000,
                           no_items=10):
     """
+    Get last viewed rooms of a session from the in-memory session index
+    Fallback to scanning the last N logs from mongodb server
+    """
+    if custom_session_id is None and ip_address is None:
+        return None
+
+    if session_index.ready:
+        room_ids = session_index.get(
+            custom_session_id, ip_address, no_items=no_items
+        )
+        if len(room_ids) == 0:
+            return None
+        return np.array(room_ids, dtype=int)
+
+    return scan_last_room_session(
+        custom_session_id, ip_address,
+        no_limit=no_limit, no_items=no_items
+    )
+
+
+def scan_last_room_session(custom_session_id=None,
+                           ip_address=None,
+                           no_limit=5000,
+                           no_items=10):
+    """
     Get last N sessions from mongodb server
     Then filter by custom_session_id field
     """
@@ -113,18 +247,100 @@ def get_last_room_session(custom_session_id=None,
     return room_ids
 
 
-def get_custom_recommender(custom_session_id,
-                           ip_address,
-                           topn=20):
+@traced("embedding")
+def session_query(bundle, room_ids, decay=SESSION_DECAY):
     """
-    Use this function to custom recommender for each user
+    Recency-weighted average of the item2vec vectors of a session,
+    rooms out of the vocabulary are skipped
+
+    :param room_ids: most recent first
+    :param decay: weight of the i-th most recent room is `decay ** i`,
+        1.0 for a plain average
+    :return (query, rows): query vector and vocabulary rows of the
+        session, None when no room is in the vocabulary
+    """
+    if bundle.vocab is None or len(room_ids) == 0:
+        return None
+    rows, found = bundle.vocab.rows(room_ids)
+    if not found.any():
+        return None
 
-    :custom_session_id str: session id
-    :time_before int: query room_ids viewed from `current_time - time_before`
-    to `current_time`
+    weights = np.power(float(decay), np.arange(len(rows)))[found]
+    rows = rows[found]
+    query = np.average(bundle.vocab.embs[rows], axis=0, weights=weights)
+    return query, rows
+
+
+@traced("ann_query")
+def session_neighbors(bundle, query, rows, topn=20):
+    """:return list: (room_id, similarity) nearest to a session query"""
+    annoy_index = bundle.indexes.get(ITEM2VEC_INDEX)
+    if annoy_index is not None:
+        # over-fetch, the rooms of the session are filtered out
+        excluded = set(bundle.wv.index2word[row] for row in rows)
+        return [
+            (room_id, sim)
+            for room_id, sim in annoy_index.most_similar(
+                query, topn + len(excluded)
+            )
+            if room_id not in excluded
+        ][:topn]
 
-    :return room_ids: recommend rooms
+    bundle.wv.init_sims()
+    nn_rows, nn_sims = most_similar_rows(
+        bundle.wv.vectors_norm, normalize(query[None]), topn,
+        exclude=[rows]
+    )
+    labels = bundle.wv.index2word
+    return [
+        (labels[j], float(sim)) for j, sim in zip(nn_rows[0], nn_sims[0])
+    ]
+
+
+def session_recommender(bundle, room_ids, topn=20):
+    """
+    Recommend from the last viewed rooms of a session, rooms of the
+    session are not recommended
+
+    :return dict: see `dict_format`
     """
+    session = session_query(bundle, room_ids)
+    if session is None:
+        return session_not_in_model()
+    query, rows = session
+
+    rooms = session_neighbors(bundle, query, rows, topn)
+
+    return dict_format(
+        code=200,
+        message="Custom recommender successfully.",
+        data=rooms,
+        errors=False
+    )
+
+
+def session_not_found():
+    return dict_format(
+        code=500,
+        message="Custom session id does not existed.",
+        data=[],
+        errors=True
+    )
+
+
+def session_not_in_model():
+    return dict_format(
+        code=500,
+        message="No room of the session in item2vec model.",
+        data=[],
+        errors=True
+    )
+
+
+def custom_recommender(custom_session_id,
+                       ip_address,
+                       topn=20):
+    """:return dict: result of `get_custom_recommender`"""
 
     # get top N last views in current session
     room_ids = get_last_room_session(
@@ -138,84 +354,366 @@ def get_custom_recommender(custom_session_id,
         str(room_ids)
     )
     if room_ids is None:
-        return json_format(
-            code=500,
-            message="Custom session id does not existed.",
-            data=[],
-            errors=True
+        return session_not_found()
+    return session_recommender(models.current, room_ids, topn)
+
+
+def get_custom_recommender(custom_session_id,
+                           ip_address,
+                           topn=20):
+    """
+    Use this function to custom recommender for each user
+
+    :custom_session_id str: session id
+    :time_before int: query room_ids viewed from `current_time - time_before`
+    to `current_time`
+
+    :return room_ids: recommend rooms
+    """
+    result = custom_recommender(custom_session_id, ip_address, topn)
+    return json_format(**result)
+
+
+def room_candidates(bundle, room_id, topn=20):
+    """
+    Nearest rooms by embeddings, before sorting by distance
+
+    :return (mode, room_ids): "item2vec" or "feature-based" and a list of
+        (room_id, similarity), or None when the room does not exist
+    """
+    check_in = str(room_id) in bundle.wv
+    if check_in:
+        room_ids = None
+        with span("ann_query"):
+            if bundle.neighbors is not None:
+                # precomputed at training time, self is excluded
+                room_ids = bundle.neighbors.most_similar(
+                    str(room_id), topn=topn
+                )
+
+            if room_ids is None:
+                annoy_index = get_indexer(bundle, room_id)
+                room_ids = bundle.wv.most_similar(
+                    str(room_id), topn=topn + 1,
+                    indexer=annoy_index
+                )[1:]
+        return "item2vec", room_ids
+
+    try:
+        logging.info("Make feature vector :: room_id:%s", str(room_id))
+        return "feature-based", get_room_by_feature_vector(
+            bundle, room_id, topn
         )
+    except Exception:
+        # room_id not existed in database
+        logging.info("Room not found :: room_id:%s", str(room_id))
+        return None
+
+
+def pool_top_k(ids, sims, topn):
+    """:return (ids, sims): `topn` most similar of a candidate pool"""
+    k = min(topn, len(ids))
+    if k == 0:
+        return ids[:0], sims[:0]
+    idx, top = top_k(sims[None], k)
+    return ids[idx[0]], top[0]
+
+
+def geo_candidates(bundle, room_id, topn=20, radius_km=GEO_RADIUS_KM):
+    """
+    Nearest rooms by embeddings among the rooms within `radius_km` of
+    the room: one product over the candidate pool instead of a search
+    over the whole catalog
 
-    if len(room_ids) == 1:
-        rooms = model.wv.most_similar(str(room_ids[0]), topn=topn)
-        return json_format(
-            code=200,
-            message="Custom recommender successfully.",
-            data=rooms,
-            errors=False
+    :return (mode, room_ids): see `room_candidates`
+    """
+    if room_id is None:
+        return None
+    main = lookup_lat_long(room_col, [int(room_id)]).get(int(room_id))
+    if main is None:
+        logging.info("Room not found :: room_id:%s", str(room_id))
+        return None
+    if room_store.snapshot is None:
+        # not loaded yet, the pool of nearby rooms is unknown
+        return nearby_candidates(bundle, room_id, main, topn, radius_km)
+    with span("geo_query"):
+        pool = room_store.within(main[0], main[1], radius_km)
+        pool = pool[pool != int(room_id)]
+
+    if str(room_id) in bundle.wv:
+        bundle.wv.init_sims()
+        norm = bundle.wv.vectors_norm
+        query = norm[bundle.wv.vocab[str(room_id)].index]
+        with span("ann_query"):
+            rows, found = bundle.vocab.rows(pool)
+            ids, sims = pool_top_k(
+                pool[found], norm[rows[found]] @ query, topn
+            )
+        return "item2vec", [
+            (str(j), float(sim)) for j, sim in zip(ids, sims)
+        ]
+
+    fb_embs = bundle.fb_embs
+    if fb_embs is None:
+        # no embedding table yet
+        return room_candidates(bundle, room_id, topn)
+    try:
+        query = normalize(get_feature_vector(bundle, room_id)[None])[0]
+    except Exception:
+        logging.info("Room not found :: room_id:%s", str(room_id))
+        return None
+    with span("ann_query"):
+        rows, found = fb_embs.rows(pool)
+        ids, sims = pool_top_k(
+            pool[found], fb_embs.embs[rows[found]] @ query, topn
         )
+    # same distance as the angular annoy index
+    dists = np.sqrt(np.maximum(2.0 - 2.0 * sims, 0.0))
+    return "feature-based", [
+        (int(j), float(dist)) for j, dist in zip(ids, dists)
+    ]
 
-    # get average embedding vectors
-    mean_emb = []
-    for room_id in room_ids:
-        try:
-            mean_emb.append(model.wv[str(int(room_id))])
-        except Exception:
-            pass
 
-    if len(mean_emb) == 0:
+def nearby_candidates(bundle, room_id, main, topn, radius_km):
+    """
+    The `GEO_FALLBACK_TOPN` most similar rooms of `room_candidates`
+    within `radius_km` of `main`, the (latitude, longitude) of the room
+
+    :return (mode, room_ids): see `room_candidates`
+    """
+    candidates = room_candidates(
+        bundle, room_id, max(topn, GEO_FALLBACK_TOPN)
+    )
+    if candidates is None:
         return None
+    mode, room_ids = candidates
+
+    lat_long = lookup_lat_long(room_col, room_ids_of(room_ids))
+    points = []
+    for candidate_id, _ in room_ids:
+        try:
+            points.append(lat_long.get(int(candidate_id), (np.nan, np.nan)))
+        except (TypeError, ValueError):
+            points.append((np.nan, np.nan))
+    if not points:
+        return mode, []
+    lats, longs = np.array(points, dtype=np.float64).T
+    # unknown coordinates compare False
+    near = haversine(main[0], main[1], lats, longs) <= radius_km
+    return mode, [r for r, n in zip(room_ids, near) if n][:topn]
+
+
+def room_not_found():
+    return dict_format(
+        code=500,
+        message="Room not found",
+        data=[],
+        errors=False
+    )
+
 
-    mean_emb = np.mean(mean_emb, axis=0)
+def cacheable(result):
+    """Found rooms only: an empty result may be filled by a refresh"""
+    return result["code"] == 200 and len(result["data"]) > 0
 
-    # item2vec model
-    rooms = model.wv.similar_by_vector(mean_emb, topn=topn)
-    return json_format(
+
+def room_result(mode, room_ids):
+    return dict_format(
         code=200,
-        message="Custom recommender successfully.",
-        data=rooms,
+        message="Recommend by {}".format(mode),
+        data=room_ids,
         errors=False
     )
 
 
-def get_room_similar(room_id, topn=20):
+def room_similar(room_id, topn=20, bundle=None, radius_km=GEO_RADIUS_KM):
+    """
+    :param radius_km: only recommend rooms within `radius_km`
+    :return dict: result of `get_room_similar`, see `dict_format`
+    """
+    bundle = bundle or models.current
+    if radius_km:
+        candidates = geo_candidates(bundle, room_id, topn, radius_km)
+    else:
+        candidates = room_candidates(bundle, room_id, topn)
+    if candidates is None:
+        return room_not_found()
+    mode, room_ids = candidates
+
+    # sorterd by lat/long distances
+    room_ids = cal_lat_long_location(
+        room_col, room_id, room_ids, return_sim=True, topn=topn
+    )
+    return room_result(mode, room_ids)
+
+
+def get_room_similar(room_id, topn=20, radius_km=GEO_RADIUS_KM):
+    # results of a bundle are cached under its version
+    bundle = models.current
+    key = ("room_similar", bundle.version, room_id, topn, radius_km)
+    result = result_cache.get(*key)
+    if result is None:
+        result = room_similar(room_id, topn, bundle, radius_km)
+        if cacheable(result):
+            result_cache.set(result, *key)
+    return json_format(**result)
 
-    mode = 1
-    check_in = str(room_id) in model.wv
-    if check_in:
-        annoy_index = get_indexer(st.MODEL_ANNOY_INDEX, model, room_id)
 
-        room_ids = model.wv.most_similar(
-            str(room_id), topn=topn + 1,
-            indexer=annoy_index
-        )[1:]
-        mode = 1
+def item2vec_batch(bundle, room_ids, topn=20):
+    """
+    Neighbors of many item2vec rooms: one slice of the neighbor table,
+    or one blocked matrix product when `topn` is not covered by it
+
+    :return dict: room_id -> list of (room_id, similarity)
+    """
+    if not room_ids:
+        return {}
+
+    wv = bundle.wv
+    rows = np.array([wv.vocab[str(r)].index for r in room_ids])
+    if bundle.neighbors is not None and topn <= bundle.neighbors.topk:
+        nn_rows = bundle.neighbors.ids[rows, :topn]
+        nn_sims = bundle.neighbors.sims[rows, :topn]
     else:
+        wv.init_sims()
+        norm = wv.vectors_norm
+        nn_rows, nn_sims = most_similar_rows(
+            norm, norm[rows], topn, exclude=rows[:, None]
+        )
+
+    labels = wv.index2word
+    return {
+        room_id: [(labels[j], float(sim)) for j, sim in zip(r_rows, r_sims)]
+        for room_id, r_rows, r_sims in zip(room_ids, nn_rows, nn_sims)
+    }
+
+
+def feature_based_batch(bundle, room_ids, topn=20):
+    """
+    Neighbors of many rooms by feature-based embeddings, as one blocked
+    matrix product over the embedding table
+
+    :return (result, not_found): room_id -> list of (room_id, distance),
+        and the room ids without a feature vector
+    """
+    result, not_found = {}, []
+    fb_embs = bundle.fb_embs
+    vectors, known = [], []
+    for room_id in room_ids:
         try:
-            logging.info("Make feature vector :: room_id:%s", str(room_id))
-            room_ids = get_room_by_feature_vector(room_id, topn=topn)
-            mode = 0
+            vectors.append(get_feature_vector(bundle, room_id))
+            known.append(room_id)
         except Exception:
-            # room_id not existed in database
-            error_message = "Room not found"
-            logging.info(
-                "%s :: room_id:%s",
-                error_message, str(room_id)
-            )
-            return json_format(
-                code=500,
-                message=error_message,
-                data=[],
-                errors=False
+            not_found.append(room_id)
+
+    if not known:
+        return result, not_found
+
+    if fb_embs is None or len(fb_embs) == 0:
+        # no embedding table yet, one annoy query per room
+        for room_id in known:
+            result[room_id] = get_room_by_feature_vector(
+                bundle, room_id, topn
             )
+        return result, not_found
 
-    # sorterd by lat/long distances
-    room_ids = cal_lat_long_location(
-        room_col, room_id, room_ids, return_sim=True, topn=topn
-    )
-    mode = "item2vec" if mode == 1 else "feature-based"
-    return json_format(
-        code=200,
-        message="Recommend by {}".format(mode),
-        data=room_ids,
-        errors=False
+    rows, found = fb_embs.rows(known)
+    exclude = [np.array([row]) if f else [] for row, f in zip(rows, found)]
+    nn_rows, nn_sims = most_similar_rows(
+        fb_embs.embs, normalize(np.vstack(vectors)), topn, exclude=exclude
     )
+    # embeddings are normalized, same distance as the angular annoy index
+    nn_dists = np.sqrt(np.maximum(2.0 - 2.0 * nn_sims, 0.0))
+    for room_id, r_rows, r_dists in zip(known, nn_rows, nn_dists):
+        result[room_id] = [
+            (int(fb_embs.ids[j]), float(dist))
+            for j, dist in zip(r_rows, r_dists)
+        ]
+    return result, not_found
+
+
+def get_rooms_similar_batch(room_ids, topn=20):
+    """
+    Recommend for many rooms with one similarity computation per model
+    and one coordinates lookup for every candidate
+
+    :return list: one `dict_format` result per room id, in order
+    """
+    bundle = models.current
+    vocab = bundle.wv.vocab if bundle.wv is not None else {}
+    i2v_ids = [r for r in room_ids if str(r) in vocab]
+    fb_ids = [r for r in room_ids if str(r) not in vocab]
+
+    candidates = {
+        room_id: ("item2vec", similar)
+        for room_id, similar in item2vec_batch(bundle, i2v_ids, topn).items()
+    }
+    fb_result, not_found = feature_based_batch(bundle, fb_ids, topn)
+    for room_id, similar in fb_result.items():
+        candidates[room_id] = ("feature-based", similar)
+
+    lookup_ids = set(int(room_id) for room_id in candidates)
+    for _, similar in candidates.values():
+        lookup_ids.update(room_ids_of(similar))
+    lat_long = lookup_lat_long(room_col, list(lookup_ids))
+
+    results = []
+    for room_id in room_ids:
+        if room_id not in candidates or int(room_id) not in lat_long:
+            results.append(room_not_found())
+            continue
+
+        mode, similar = candidates[room_id]
+        results.append(room_result(mode, rerank_by_distance(
+            room_id, similar, lat_long, return_sim=True, topn=topn
+        )))
+    return results
+
+
+def get_custom_recommender_batch(custom_session_ids, topn=20):
+    """
+    Recommend for many sessions with one matrix product over
+    the item2vec vectors, rooms of the session are not recommended
+
+    :return list: one `dict_format` result per session, in order
+    """
+    bundle = models.current
+    wv = bundle.wv
+    results = [None] * len(custom_session_ids)
+    queries, excludes, positions = [], [], []
+    for i, custom_session_id in enumerate(custom_session_ids):
+        room_ids = get_last_room_session(
+            custom_session_id, None,
+            no_limit=st.NO_LIMIT,
+            no_items=st.NO_ITEMS
+        )
+        if room_ids is None:
+            results[i] = session_not_found()
+            continue
+
+        session = session_query(bundle, room_ids)
+        if session is None:
+            results[i] = session_not_in_model()
+            continue
+
+        queries.append(session[0])
+        excludes.append(session[1])
+        positions.append(i)
+
+    if queries:
+        wv.init_sims()
+        nn_rows, nn_sims = most_similar_rows(
+            wv.vectors_norm, normalize(np.vstack(queries)), topn,
+            exclude=excludes
+        )
+        labels = wv.index2word
+        for i, r_rows, r_sims in zip(positions, nn_rows, nn_sims):
+            results[i] = dict_format(
+                code=200,
+                message="Custom recommender successfully.",
+                data=[
+                    (labels[j], float(sim)) for j, sim in zip(r_rows, r_sims)
+                ],
+                errors=False
+            )
+    return results
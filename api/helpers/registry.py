@@ -0,0 +1,109 @@
+import logging
+import os
+import time
+
+from annoy import AnnoyIndex
+
+from api.helpers.ann_builder import SearchKAnnoyIndexer
+from api.helpers.utils import rss
+
+
+class IndexEntry:
+
+    def __init__(self, path, loader, watch=None, index=None, stats=None):
+        self.path = path
+        self.loader = loader
+        self.watch = watch or path
+        self.index = index
+        self.stats = stats or {}
+
+
+class IndexRegistry:
+    """
+    ANN indexes of one `ModelBundle`
+
+    Annoy indexes are memory-mapped by `load`, so the pages are shared
+    by every worker through the OS page cache. An index is loaded once,
+    with the models of its bundle: a retrained index is only served once
+    `ModelManager` swaps in the bundle of its version, so it is never
+    queried with the vectors of another model.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def register(self, name, path, loader, watch=None):
+        """
+        :param name str: key of the index
+        :param path str: index file, `loader(path)` must return the index
+        :param watch str: file written last when the index is saved,
+            default to `path`
+        """
+        self._entries[name] = IndexEntry(path, loader, watch=watch)
+        try:
+            self._load(name)
+        except Exception as e:
+            logging.exception(e)
+        return self
+
+    def get(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        return entry.index
+
+    def _load(self, name):
+        entry = self._entries[name]
+        if not os.path.exists(entry.watch):
+            # not trained yet
+            return
+
+        start_ = time.time()
+        rss_before = rss()
+        index = entry.loader(entry.path)
+        stats = {
+            "path": entry.path,
+            "load_time": round(time.time() - start_, 4),
+            "mapped_size": _size(entry.path),
+            "rss_delta": rss() - rss_before,
+        }
+        self._entries[name] = IndexEntry(
+            entry.path, entry.loader, watch=entry.watch,
+            index=index, stats=stats
+        )
+
+        logging.info(
+            "Load index :: name:%s - took:%.2f's - mapped:%.1fMB - rss:+%.1fMB",  # noqa
+            name, stats["load_time"],
+            stats["mapped_size"] / 1024 ** 2,
+            stats["rss_delta"] / 1024 ** 2
+        )
+
+    def stats(self):
+        return {name: entry.stats for name, entry in self._entries.items()}
+
+
+def annoy_indexer_loader(wv):
+    """Loader of a gensim `AnnoyIndexer` saved with the item2vec model"""
+    def load(fpath):
+        annoy_index = SearchKAnnoyIndexer()
+        annoy_index.load(fpath)
+        annoy_index.model = wv
+        return annoy_index
+    return load
+
+
+def annoy_loader(dims):
+    """Loader of a raw `AnnoyIndex`"""
+    def load(fpath):
+        index = AnnoyIndex(dims)
+        index.load(fpath)
+        return index
+    return load
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
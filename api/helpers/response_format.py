@@ -1,13 +1,27 @@
 from django.http import JsonResponse
 
+from api.helpers.tracing import span
 
-def json_format(code=200,
+
+def dict_format(code=200,
                 message='Default Message!',
                 data=None,
                 errors=None):
-    return JsonResponse({
+    return {
         'code': code,
         'data': data,
         'message': message,
         'errors': errors
-    }, status=code)
+    }
+
+
+def json_format(code=200,
+                message='Default Message!',
+                data=None,
+                errors=None):
+    # the response is serialized by its constructor
+    with span("serialization"):
+        return JsonResponse(
+            dict_format(code=code, message=message, data=data, errors=errors),
+            status=code
+        )
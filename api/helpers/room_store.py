@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+
+from django.conf import settings as st
+import numpy as np
+
+from api.helpers.geo import GeoIndex
+
+
+ROOM_STORE_REFRESH = getattr(st, "ROOM_STORE_REFRESH", 300)
+
+
+class RoomSnapshot:
+    """
+    Immutable, columnar view of the rooms collection
+
+    Rows are sorted by room id so lookups are a single `np.searchsorted`.
+    Only coordinates and status are kept: feature documents are served
+    by the feature-based embeddings, see `get_feature_vector`.
+    """
+
+    def __init__(self, ids, lats, longs, status,
+                 max_id=None, max_updated_at=None):
+        order = np.argsort(ids, kind="mergesort")
+        self.ids = ids[order]
+        self.lats = lats[order]
+        self.longs = longs[order]
+        self.status = status[order]
+        self.max_id = max_id
+        self.max_updated_at = max_updated_at
+        self._geo = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def geo(self):
+        """`GeoIndex` of the snapshot, built on first use"""
+        if self._geo is None:
+            self._geo = GeoIndex(self.ids, self.lats, self.longs)
+        return self._geo
+
+    @classmethod
+    def from_docs(cls, docs, max_id=None, max_updated_at=None):
+        # the last document of a room wins
+        rooms = {}
+        for doc in docs:
+            try:
+                rooms[int(doc["id"])] = doc
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        ids, lats, longs, status = [], [], [], []
+        for room_id, doc in rooms.items():
+            ids.append(room_id)
+            lat, long = _lat_long(doc)
+            lats.append(lat)
+            longs.append(long)
+            status.append(doc.get("status"))
+
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(lats, dtype=np.float64),
+            np.array(longs, dtype=np.float64),
+            _object_array(status),
+            max_id=max_id,
+            max_updated_at=max_updated_at
+        )
+
+    def rows(self, room_ids):
+        """
+        :return (rows, found): row of each room id and a mask of
+            the room ids existed in the snapshot
+        """
+        room_ids = np.asarray(room_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, room_ids)
+        rows = np.minimum(rows, max(len(self.ids) - 1, 0))
+        if len(self.ids) == 0:
+            return rows, np.zeros(len(room_ids), dtype=bool)
+        found = self.ids[rows] == room_ids
+        return rows, found
+
+    def merge(self, other):
+        """Return a new snapshot with rows of `other` replacing ours"""
+        keep = ~np.isin(self.ids, other.ids)
+        return RoomSnapshot(
+            np.concatenate([self.ids[keep], other.ids]),
+            np.concatenate([self.lats[keep], other.lats]),
+            np.concatenate([self.longs[keep], other.longs]),
+            np.concatenate([self.status[keep], other.status]),
+            max_id=_max(self.max_id, other.max_id),
+            max_updated_at=_max(self.max_updated_at, other.max_updated_at)
+        )
+
+
+class RoomStore:
+    """
+    In-process room metadata, loaded once at startup then refreshed
+    incrementally from mongo with `_id`/`updated_at` watermarks.
+
+    Refreshes build a new `RoomSnapshot` and swap the reference, so
+    readers always see a complete snapshot.
+    """
+
+    def __init__(self, col, refresh_interval=ROOM_STORE_REFRESH):
+        self.col = col
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def projection(self):
+        return {
+            "id": 1,
+            "status": 1,
+            "updated_at": 1,
+            "room_address.latitude": 1,
+            "room_address.longitude": 1,
+        }
+
+    def _fetch(self, query):
+        max_id, max_updated_at = None, None
+        docs = []
+        for doc in self.col.find(query, self.projection()):
+            max_id = _max(max_id, doc.get("_id"))
+            max_updated_at = _max(max_updated_at, doc.get("updated_at"))
+            docs.append(doc)
+        return RoomSnapshot.from_docs(
+            docs, max_id=max_id, max_updated_at=max_updated_at
+        )
+
+    def load(self):
+        start_ = time.time()
+        snapshot = self._fetch({})
+        with self._lock:
+            self._snapshot = snapshot
+        logging.info(
+            "Load room store :: rooms:%d - took:%.2f's",
+            len(snapshot), time.time() - start_
+        )
+        return self
+
+    def refresh(self):
+        if self._snapshot is None:
+            return self.load()
+
+        with self._lock:
+            current = self._snapshot
+            watermarks = []
+            if current.max_id is not None:
+                watermarks.append({"_id": {"$gt": current.max_id}})
+            if current.max_updated_at is not None:
+                watermarks.append(
+                    {"updated_at": {"$gt": current.max_updated_at}}
+                )
+            query = {"$or": watermarks} if watermarks else {}
+
+            changed = self._fetch(query)
+            if len(changed) > 0:
+                self._snapshot = current.merge(changed)
+            logging.info("Refresh room store :: changed:%d", len(changed))
+        return self
+
+    def start(self):
+        """Refresh in a daemon thread every `refresh_interval` seconds"""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logging.exception(e)
+
+        self._thread = threading.Thread(
+            target=run, name="room-store-refresh", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def lat_long(self, room_ids):
+        """
+        :return dict: room_id (int) -> (latitude, longitude) for rooms
+            existed in the store with known coordinates
+        """
+        snapshot = self._snapshot
+        if snapshot is None or len(room_ids) == 0:
+            return {}
+
+        room_ids = np.asarray(room_ids, dtype=np.int64)
+        rows, found = snapshot.rows(room_ids)
+        lats, longs = snapshot.lats[rows], snapshot.longs[rows]
+        found &= ~(np.isnan(lats) | np.isnan(longs))
+
+        return {
+            int(room_id): (float(lat), float(long))
+            for room_id, lat, long in zip(
+                room_ids[found], lats[found], longs[found]
+            )
+        }
+
+    def within(self, lat, long, radius_km):
+        """:return array: ids of the rooms within `radius_km` of a point"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return np.zeros(0, dtype=np.int64)
+        return snapshot.geo.within(lat, long, radius_km)
+
+    def missing(self, room_ids):
+        """:return list: room ids not existed in the store"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return list(room_ids)
+        _, found = snapshot.rows(room_ids)
+        return [room_id for room_id, f in zip(room_ids, found) if not f]
+
+
+def _lat_long(doc):
+    try:
+        address = doc["room_address"]
+        return float(address["latitude"]), float(address["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return np.nan, np.nan
+
+
+def _object_array(values):
+    # avoid numpy guessing a dtype from the values
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
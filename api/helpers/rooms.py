@@ -0,0 +1,72 @@
+import logging
+
+from django.conf import settings as st
+import pandas as pd
+
+
+FB_BATCH_SIZE = getattr(st, "FB_BATCH_SIZE", 5000)
+FB_FIT_SAMPLE = getattr(st, "FB_FIT_SAMPLE", 50000)
+
+# same filters as `make_feature_based`, run by the mongo server
+LISTED_QUERY = {
+    "status": "Listed",
+    "content": {"$ne": None},
+    "name": {"$ne": None},
+    "amenities": {"$ne": None},
+    "submit_status": {"$ne": None},
+}
+
+
+def room_projection(fields=None):
+    """Fields read by the feature-based pipeline, and the address"""
+    projection = {fea: 1 for fea in (fields or st.TOTAL_FEATURES)}
+    projection.update({"id": 1, "room_address": 1, "_id": 0})
+    return projection
+
+
+def flatten_room(doc):
+    """
+    Merge the room with its address, as the `room_address` DataFrame
+    merged on `id` == `room_id`: fields of the room win
+    """
+    address = doc.pop("room_address", None)
+    if isinstance(address, dict):
+        for key, value in address.items():
+            doc.setdefault(key, value)
+    return doc
+
+
+def sample_rooms(col, size=FB_FIT_SAMPLE, query=None):
+    """:return DataFrame: random listed rooms, to fit the pipeline"""
+    cur = col.aggregate(
+        [
+            {"$match": query or LISTED_QUERY},
+            {"$sample": {"size": size}},
+            {"$project": room_projection()},
+        ],
+        allowDiskUse=True
+    )
+    rooms = pd.DataFrame([flatten_room(doc) for doc in cur])
+    logging.info("Sample rooms :: rooms:%d", len(rooms))
+    return rooms
+
+
+def stream_rooms(col, batch_size=FB_BATCH_SIZE, query=None):
+    """
+    Listed rooms in batches of `batch_size`, only one batch is held in
+    memory at a time
+
+    :return generator: DataFrames of flattened rooms
+    """
+    cur = col.find(
+        query or LISTED_QUERY, room_projection(), batch_size=batch_size
+    )
+
+    batch = []
+    for doc in cur:
+        batch.append(flatten_room(doc))
+        if len(batch) == batch_size:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
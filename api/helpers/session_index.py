@@ -0,0 +1,169 @@
+from collections import OrderedDict, deque
+import logging
+import threading
+import time
+
+from django.conf import settings as st
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+SESSION_INDEX_TTL = getattr(st, "SESSION_INDEX_TTL", 3600)
+SESSION_INDEX_MAX_KEYS = getattr(st, "SESSION_INDEX_MAX_KEYS", 200000)
+SESSION_INDEX_POLL = getattr(st, "SESSION_INDEX_POLL", 1)
+
+PROJECTION = {"custom_session_id": 1, "room_id": 1, "ip_address": 1}
+
+
+class SessionIndex:
+    """
+    Bounded in-memory index of recent room views
+
+    Maps `custom_session_id` and `ip_address` to a ring buffer of the last
+    viewed room ids (most recent first). Keys not seen for `ttl` seconds
+    are evicted, and at most `max_keys` keys are kept per table.
+
+    Fed from a change stream on the log collection, or from a poller on
+    `_id` when change streams are not available (standalone server).
+    """
+
+    def __init__(self, col,
+                 maxlen=st.NO_ITEMS,
+                 ttl=SESSION_INDEX_TTL,
+                 max_keys=SESSION_INDEX_MAX_KEYS,
+                 poll_interval=SESSION_INDEX_POLL):
+        self.col = col
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.poll_interval = poll_interval
+
+        self._sessions = OrderedDict()
+        self._ips = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_id = None
+        self._thread = None
+        self.ready = False
+
+    def __len__(self):
+        return len(self._sessions) + len(self._ips)
+
+    def add(self, doc, now=None):
+        room_id = doc.get("room_id")
+        if room_id is None:
+            return
+        try:
+            entry = (doc["_id"], int(room_id))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        now = time.time() if now is None else now
+        with self._lock:
+            session_id = doc.get("custom_session_id")
+            if session_id is not None:
+                self._push(self._sessions, session_id, entry, now)
+            if doc.get("ip_address") is not None:
+                self._push(self._ips, doc["ip_address"], entry, now)
+            if self._last_id is None or entry[0] > self._last_id:
+                self._last_id = entry[0]
+
+    def _push(self, table, key, entry, now):
+        item = table.pop(key, None)
+        buf = deque(maxlen=self.maxlen) if item is None else item[1]
+        if entry not in buf:
+            buf.appendleft(entry)
+        table[key] = (now, buf)
+
+        # least recently updated keys are at the front
+        while len(table) > self.max_keys:
+            table.popitem(last=False)
+        expired = now - self.ttl
+        while table:
+            last_seen, _ = next(iter(table.values()))
+            if last_seen >= expired:
+                break
+            table.popitem(last=False)
+
+    def _recent(self, table, key, expired):
+        item = table.get(key)
+        if item is None or item[0] < expired:
+            return []
+        return list(item[1])
+
+    def get(self, custom_session_id=None, ip_address=None, no_items=10):
+        """
+        :return list: last viewed room ids of the session and/or the ip
+            address, most recent first
+        """
+        expired = time.time() - self.ttl
+        with self._lock:
+            entries = []
+            if custom_session_id is not None:
+                entries += self._recent(
+                    self._sessions, custom_session_id, expired
+                )
+            if ip_address is not None:
+                entries += self._recent(self._ips, ip_address, expired)
+
+        # a log may be in both buffers
+        entries = sorted(set(entries), key=lambda x: x[0], reverse=True)
+        return [room_id for _, room_id in entries[:no_items]]
+
+    def bootstrap(self, no_limit=st.NO_LIMIT):
+        cur = self.col.find(
+            {"room_id": {"$ne": None}}, PROJECTION
+        ).limit(no_limit).sort("_id", -1)
+        docs = list(cur)
+        for doc in reversed(docs):
+            self.add(doc)
+        logging.info("Bootstrap session index :: logs:%d", len(docs))
+
+    def _watch(self):
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            "fullDocument.room_id": {"$ne": None}
+        }}]
+        with self.col.watch(pipeline) as stream:
+            # opened before bootstrap so no insert is missed in between
+            self.bootstrap()
+            self.ready = True
+            logging.info("Session index :: follow change stream")
+            for change in stream:
+                self.add(change["fullDocument"])
+
+    def _poll(self):
+        if not self.ready:
+            self.bootstrap()
+            self.ready = True
+        logging.info("Session index :: poll every %ss", self.poll_interval)
+        while True:
+            try:
+                query = {"room_id": {"$ne": None}}
+                if self._last_id is not None:
+                    query["_id"] = {"$gt": self._last_id}
+                for doc in self.col.find(query, PROJECTION).sort("_id", 1):
+                    self.add(doc)
+            except PyMongoError as e:
+                logging.exception(e)
+            time.sleep(self.poll_interval)
+
+    def _run(self):
+        while True:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                # change streams need a replica set
+                logging.info("Change stream not supported :: %s", e)
+                break
+            except PyMongoError as e:
+                logging.exception(e)
+                time.sleep(self.poll_interval)
+        self._poll()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(
+            target=self._run, name="session-index", daemon=True
+        )
+        self._thread.start()
+        return self
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+from multiprocessing import Pool
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings as st
+
+from api.helpers.cleaners import PREPROCESS_VERSION, preprocess_text_v2
+
+
+TEXT_CACHE_PATH = getattr(
+    st, "TEXT_CACHE_PATH", os.path.join(st.BASE_MODEL, "text_cache.sqlite")
+)
+PREPROCESS_JOBS = getattr(st, "PREPROCESS_JOBS", os.cpu_count() or 1)
+PREPROCESS_CHUNK = getattr(st, "PREPROCESS_CHUNK", 64)
+SQLITE_BATCH = 500
+
+
+def text_key(name, content, version=PREPROCESS_VERSION):
+    # texts cached by another version of the cleaner are never hit
+    text = u"{}\x00{}\x00{}".format(version, name or "", content or "")
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TextCache:
+    """
+    Persistent cache of preprocessed listing texts, keyed by a hash of
+    the preprocessing version, `name` and `content`, shared by rebuilds
+    and the API workers
+
+    Each thread has its own connection, sqlite serializes the writes.
+    """
+
+    def __init__(self, fpath=TEXT_CACHE_PATH):
+        self.fpath = fpath
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        local = self._local
+        # sqlite connections must not cross a fork
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.fpath, timeout=30)
+            local.conn.execute(
+                "CREATE TABLE IF NOT EXISTS texts "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            local.pid = os.getpid()
+        return local.conn
+
+    def get_many(self, keys):
+        keys = list(keys)
+        result = {}
+        for start in range(0, len(keys), SQLITE_BATCH):
+            batch = keys[start:start + SQLITE_BATCH]
+            cur = self.conn.execute(
+                "SELECT key, value FROM texts WHERE key IN ({})".format(
+                    ",".join("?" * len(batch))
+                ),
+                batch
+            )
+            result.update(cur.fetchall())
+        return result
+
+    def set_many(self, items):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO texts (key, value) VALUES (?, ?)",
+                list(items)
+            )
+
+
+text_cache = TextCache()
+
+
+def preprocess_many(contents,
+                    names=None,
+                    n_jobs=PREPROCESS_JOBS,
+                    chunksize=PREPROCESS_CHUNK,
+                    cache=None):
+    """
+    `preprocess_text_v2` of many contents, skipping the ones already in
+    `cache` and spreading the others over a pool of `n_jobs` processes
+
+    :return list: preprocessed contents, in the same order
+    """
+    if names is None:
+        names = [None] * len(contents)
+    keys = [text_key(name, content) for name, content in zip(names, contents)]
+
+    done = {}
+    if cache is not None:
+        try:
+            done = cache.get_many(set(keys))
+        except sqlite3.Error as e:
+            logging.exception(e)
+
+    todo = {}
+    for key, content in zip(keys, contents):
+        if key not in done:
+            todo[key] = content
+
+    start_ = time.time()
+    todo_keys = list(todo)
+    todo_contents = [todo[key] for key in todo_keys]
+    if n_jobs > 1 and len(todo_contents) > chunksize:
+        with Pool(n_jobs) as pool:
+            texts = pool.map(preprocess_text_v2, todo_contents, chunksize)
+    else:
+        texts = [preprocess_text_v2(content) for content in todo_contents]
+    done.update(zip(todo_keys, texts))
+
+    if cache is not None and todo_keys:
+        try:
+            cache.set_many(zip(todo_keys, texts))
+        except sqlite3.Error as e:
+            logging.exception(e)
+
+    if len(keys) > 1:
+        logging.info(
+            "Preprocess texts :: total:%d - cached:%d - took:%.2f's",
+            len(keys), len(keys) - len(todo_keys), time.time() - start_
+        )
+    return [done[key] for key in keys]
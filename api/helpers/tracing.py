@@ -0,0 +1,260 @@
+"""
+Per-stage timings of sampled requests
+
+A request is traced with probability `TRACE_SAMPLE_RATE`. Its stages
+(session lookup, embedding, ANN query, metadata fetch, re-rank,
+serialization) are timed by `span`, then on `Trace.finish` the timing
+breakdown is logged and aggregated into the histograms of `metrics`,
+served in the Prometheus text format by `luxstay/metrics`.
+
+Histograms live in the memory of each worker process: every series
+carries a `pid` label so the series of the workers behind one scrape
+target are told apart, sum them by `request` and `stage` in queries.
+
+When a request is not sampled `span` returns a shared no-op, so
+tracing off costs a thread-local lookup per stage.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings as st
+
+
+# share of requests traced, 0 to turn tracing off
+TRACE_SAMPLE_RATE = getattr(st, "TRACE_SAMPLE_RATE", 0.01)
+# upper bounds of the histogram buckets, in seconds
+TRACE_BUCKETS = getattr(
+    st, "TRACE_BUCKETS",
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+     1.0, 2.5, 5.0)
+)
+TRACE_METRIC = getattr(st, "TRACE_METRIC", "luxstay_stage_duration_seconds")
+
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class Histogram:
+
+    def __init__(self, buckets=TRACE_BUCKETS):
+        self.buckets = sorted(buckets)
+        # the last bucket is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Histograms of stage durations, by request name and stage"""
+
+    def __init__(self, name=TRACE_METRIC, buckets=TRACE_BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, samples):
+        """:param samples: list of (request, stage, seconds)"""
+        with self._lock:
+            for request, stage, took in samples:
+                hist = self._histograms.get((request, stage))
+                if hist is None:
+                    hist = Histogram(self.buckets)
+                    self._histograms[(request, stage)] = hist
+                hist.observe(took)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """:return str: histograms in the Prometheus text format"""
+        lines = [
+            "# HELP {} Duration of the stages of sampled requests".format(
+                self.name
+            ),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        pid = os.getpid()
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for (request, stage), hist in items:
+                labels = 'pid="{}",request="{}",stage="{}"'.format(
+                    pid, request, stage
+                )
+                cumulative = 0
+                bounds = [repr(float(b)) for b in hist.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, hist.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        self.name, labels, bound, cumulative
+                    ))
+                lines.append("{}_sum{{{}}} {!r}".format(
+                    self.name, labels, hist.sum
+                ))
+                lines.append("{}_count{{{}}} {}".format(
+                    self.name, labels, hist.count
+                ))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """Spans of one request, may be filled from several threads"""
+
+    def __init__(self, name):
+        self.name = name
+        self.id = next(_ids)
+        self.spans = []
+        self._start = time.perf_counter()
+
+    def span(self, stage):
+        return Span(self, stage)
+
+    def breakdown(self):
+        """:return list: (stage, seconds) summed by stage, in order"""
+        totals = {}
+        for stage, took in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + took
+        return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+    def finish(self):
+        took = time.perf_counter() - self._start
+        # one observation per stage of the request, whatever the number
+        # of calls of the stage
+        breakdown = self.breakdown()
+        metrics.observe(
+            [(self.name, stage, t) for stage, t in breakdown] +
+            [(self.name, "total", took)]
+        )
+        logging.info(
+            "Trace :: request:%s - id:%d - total:%.2fms - %s",
+            self.name, self.id, took * 1000,
+            " - ".join(
+                "{}:{:.2f}ms".format(stage, t * 1000)
+                for stage, t in breakdown
+            )
+        )
+        return took
+
+
+class Span:
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans.append(
+            (self.stage, time.perf_counter() - self.start)
+        )
+        return False
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def current():
+    """:return Trace: trace of the running thread, None if not sampled"""
+    return getattr(_local, "trace", None)
+
+
+def sample(name, rate=None):
+    """:return Trace: a new trace for `rate` of the calls, else None"""
+    rate = TRACE_SAMPLE_RATE if rate is None else rate
+    if rate <= 0 or random.random() >= rate:
+        return None
+    return Trace(name)
+
+
+@contextmanager
+def activate(trace):
+    """Make `trace` the trace of the running thread"""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def start_trace(name, rate=None):
+    """
+    Trace a synchronous request, one thread from start to end
+
+    Coroutines share their thread: use `sample` and `bind` instead.
+    """
+    trace = sample(name, rate)
+    if trace is None:
+        yield None
+        return
+    with activate(trace):
+        try:
+            yield trace
+        finally:
+            trace.finish()
+
+
+def span(stage, trace=None):
+    """Context manager timing `stage` of `trace`, default to `current`"""
+    trace = trace or current()
+    if trace is None:
+        return NOOP_SPAN
+    return Span(trace, stage)
+
+
+def traced(stage):
+    """Decorator: the calls of a function are spans of `stage`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = current()
+            if trace is None:
+                return func(*args, **kwargs)
+            with Span(trace, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(trace, func):
+    """`func` running under `trace`, e.g. in a thread pool"""
+    if trace is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with activate(trace):
+            return func(*args, **kwargs)
+    return wrapper
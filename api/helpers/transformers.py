@@ -1,9 +1,14 @@
+from django.conf import settings as st
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import MultiLabelBinarizer
 import pandas as pd
 
-from api.helpers.cleaners import preprocess_text
+from api.helpers.text_cache import (
+    PREPROCESS_JOBS,
+    preprocess_many,
+    text_cache
+)
 from api.helpers.utils import connect_to
 
 
@@ -12,7 +17,7 @@ class Simplify(BaseEstimator, TransformerMixin):
         self.col = col
 
     def fetch(self):
-        col = connect_to(col=self.col)
+        col = connect_to(db=st.MONGO_DB, col=self.col)
 
         # exclude default _id
         query = {"_id": 0}
@@ -44,14 +49,23 @@ class NumericalTransformer(BaseEstimator, TransformerMixin):
 
 
 class SequenceTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self):
-        pass
+    def __init__(self, n_jobs=PREPROCESS_JOBS, use_cache=True):
+        self.n_jobs = n_jobs
+        self.use_cache = use_cache
 
     def fit(self, X, y=None):
         return self
 
     def transform(self, X, y=None):
-        res = X["name"].str.lower() + X["content"].apply(preprocess_text)
+        # NOTE: pipelines dumped before `n_jobs`/`use_cache` existed
+        n_jobs = getattr(self, "n_jobs", 1)
+        cache = text_cache if getattr(self, "use_cache", True) else None
+
+        contents = preprocess_many(
+            X["content"].values, X["name"].values,
+            n_jobs=n_jobs, cache=cache
+        )
+        res = X["name"].str.lower() + pd.Series(contents, index=X.index)
         return res.values
 
 
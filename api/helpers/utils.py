@@ -1,51 +1,192 @@
 import datetime
+import glob
+import os
+import resource
+import threading
 import time
 from functools import wraps
 import logging
 from urllib.parse import quote_plus
 
 from django.conf import settings as st
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference
+
+from api.helpers.tracing import span
 
 
 def timer(func):
+    """Log the time of each call, a span of the current trace if any"""
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print("- Function {} tooks {}'s".format(func.__name__, end - start))
+        with span(func.__name__):
+            result = func(*args, **kwargs)
+        logging.info(
+            "Timer :: func:%s - took:%.4f's",
+            func.__name__, time.time() - start
+        )
         return result
     return wrapper
 
 
+MONGO_MAX_POOL_SIZE = getattr(st, "MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = getattr(st, "MONGO_MIN_POOL_SIZE", 0)
+# None: wait for a free connection forever
+MONGO_WAIT_QUEUE_TIMEOUT_MS = getattr(st, "MONGO_WAIT_QUEUE_TIMEOUT_MS", None)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = getattr(
+    st, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000
+)
+# name of a `pymongo.ReadPreference`, for reads of the whole log collection
+MONGO_SCAN_READ_PREFERENCE = getattr(
+    st, "MONGO_SCAN_READ_PREFERENCE", "SECONDARY_PREFERRED"
+)
+
+
+class ClientRegistry:
+    """
+    One `MongoClient` per server and per process
+
+    Clients are created with `connect=False`: nothing is opened before
+    the first query, so a gunicorn master preloading the app does not
+    hand sockets to its workers. A forked worker gets new clients.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, host, port, user=None, password=None, db=None):
+        # authenticated clients use `db` as their auth source
+        if user is None or password is None:
+            db = None
+        key = (host, str(port), user, password, db)
+        if self._pid != os.getpid():
+            # sockets of the parent process are never reused, nor its lock
+            self._lock = threading.Lock()
+            self._clients = {}
+            self._pid = os.getpid()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self._connect(*key)
+            return client
+
+    def _connect(self, host, port, user, password, db):
+        kwargs = dict(
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connect=False
+        )
+        logging.info(
+            "Mongo client :: host:%s - port:%s - pid:%s - max_pool_size:%s",
+            host, port, os.getpid(), MONGO_MAX_POOL_SIZE
+        )
+        if user is not None and password is not None:
+            uri = "mongodb://%s:%s@%s:%s/%s" % (
+                quote_plus(user),
+                quote_plus(password),
+                quote_plus(host),
+                quote_plus(str(port)),
+                quote_plus(db)
+            )
+            return MongoClient(uri, **kwargs)
+        return MongoClient(host=host, port=int(port), **kwargs)
+
+
+clients = ClientRegistry()
+
+
+class LazyCollection:
+    """
+    Collection of the registry client of the current process,
+    resolved on every attribute access so it stays valid after a fork
+    """
+
+    def __init__(self, client_args, db, col, read_preference=None):
+        self.client_args = client_args
+        self.db = db
+        self.col = col
+        self.read_preference = read_preference
+
+    @property
+    def collection(self):
+        read_preference = self.read_preference
+        if isinstance(read_preference, str):
+            read_preference = getattr(ReadPreference, read_preference)
+        return clients.get(*self.client_args)[self.db].get_collection(
+            self.col, read_preference=read_preference
+        )
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.collection, name)
+
+    def __repr__(self):
+        return "LazyCollection(%s.%s)" % (self.db, self.col)
+
+
 def connect_to(host=st.MONGO_HOST,
                port=st.MONGO_PORT,
                user=st.MONGO_USER,
                password=st.MONGO_PASSWORD,
                db=None,
-               col=None):
+               col=None,
+               read_preference=None):
+    """
+    :param read_preference: name of a `pymongo.ReadPreference`, e.g.
+        `MONGO_SCAN_READ_PREFERENCE`, default to the primary
+    :return LazyCollection: see `ClientRegistry`
+    """
 
     if db is None or col is None:
         logging.error("Must be included `db` and `col` fields")
 
     logging.info("Load :: database:%s - collection:%s", db, col)
-    if user is not None and password is not None:
-        uri = "mongodb://%s:%s@%s:%s/%s" % (
-            quote_plus(user),
-            quote_plus(password),
-            quote_plus(host),
-            quote_plus(port),
-            quote_plus(db)
-        )
-        client = MongoClient(uri)
-    else:
-        client = MongoClient(host=host, port=int(port))
+    return LazyCollection(
+        (host, port, user, password, db), db, col, read_preference
+    )
+
+
+def save_atomic(save, *fpaths, sidecars_last=False):
+    """
+    `save(*tmp_paths)` to temporary files, then rename each to its path
+    of `fpaths`, in order: the file referencing the others goes last
+
+    Never rewrite an artifact in place: workers keep the old file
+    memory-mapped, and published versions hard-link the same inode.
 
-    db = client[db]
-    col = db[col]
+    :param sidecars_last: rename the files saved apart next to a path,
+        e.g. gensim's `<fpath>.<attr>.npy`, after it instead of before
+    :return str: the last path
+    """
+    tmp_paths = [fpath + ".tmp" for fpath in fpaths]
+    save(*tmp_paths)
+    for tmp_path, fpath in zip(tmp_paths, fpaths):
+        sidecars = [
+            (path, fpath + path[len(tmp_path):])
+            for path in glob.glob(glob.escape(tmp_path) + ".*")
+        ]
+        if sidecars_last:
+            os.replace(tmp_path, fpath)
+        for src, dst in sidecars:
+            os.replace(src, dst)
+        if not sidecars_last:
+            os.replace(tmp_path, fpath)
+    return fpaths[-1]
 
-    return col
+
+def rss():
+    """Resident set size of the current process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
 
 
 def mem_use(df):
@@ -61,3 +202,8 @@ def dt_fmt(fmt="%d-%m-%Y-%H-%M-%S"):
 
 def convert_time(epoch_time, fmt="%Y-%m-%d %H:%M:%S"):
     return datetime.datetime.fromtimestamp(epoch_time).strftime(fmt)
+
+
+def int_list(value):
+    """Argument type of comma separated integers, e.g. `1,4,16`"""
+    return [int(v) for v in value.split(",")]
@@ -0,0 +1,42 @@
+from django.conf import settings as st
+from django.core.management.base import BaseCommand
+from gensim.models import Word2Vec
+
+from api.helpers.ann_builder import recall_report
+from api.helpers.embeddings import EmbeddingTable
+from api.helpers.utils import int_list
+
+
+class Command(BaseCommand):
+    help = "Report annoy recall vs latency against exact brute force"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trees", type=int_list, default=[10, 50, 100])
+        parser.add_argument("--search-k", type=int_list, default=[-1])
+        parser.add_argument("--k", type=int, default=20)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument(
+            "--model", choices=["item2vec", "feature_based"],
+            default="item2vec"
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["model"] == "feature_based":
+            vectors = EmbeddingTable.load().embs
+        else:
+            model = Word2Vec.load(st.MODEL_ITEM2VEC)
+            model.init_sims()
+            vectors = model.wv.vectors_norm
+
+        rows = recall_report(
+            vectors,
+            trees=kwargs["trees"],
+            search_ks=kwargs["search_k"],
+            k=kwargs["k"],
+            n_queries=kwargs["queries"]
+        )
+        for row in rows:
+            self.stdout.write(
+                "trees:{} - search_k:{} - recall:{} - {}ms/query - build:{}'s".format(*row)  # noqa
+            )
+        self.stdout.write(self.style.SUCCESS("Report completed"))
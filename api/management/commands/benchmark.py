@@ -0,0 +1,183 @@
+import datetime
+import json
+import tempfile
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+import numpy as np
+from tabulate import tabulate
+
+from api.helpers import recommenders
+from api.helpers.benchmark import (
+    git_commit,
+    measure,
+    measure_once,
+    patched,
+    synthetic_logs,
+    synthetic_rooms,
+    synthetic_sessions
+)
+from api.helpers.bundle import ModelBundle
+from api.helpers.cache import ResultCache
+from api.helpers.cleaners import preprocess_text, preprocess_text_v2
+from api.helpers.item2vec import train_item2vec
+from api.helpers.room_store import RoomStore
+from api.helpers.session_index import SessionIndex
+from api.helpers.utils import int_list
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the recommender hot paths on a synthetic room catalog "
+        "and click log, served by an in-memory mongo (mongomock). The "
+        "stores of `api` are replaced by the benchmark's, run it with "
+        "API_DEFER_START=1 to not start their refreshes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int_list, default=[1000, 10000, 50000],
+            help="comma separated numbers of rooms"
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--clicks-per-room", type=int, default=20)
+        parser.add_argument("--topn", type=int, default=20)
+        parser.add_argument("--radius-km", type=float, default=10)
+        parser.add_argument(
+            "--output", type=str, default="benchmark.json",
+            help="results as json, to compare between commits"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run_size(self, no_rooms, kwargs):
+        try:
+            import mongomock
+        except ImportError:
+            raise CommandError(
+                "mongomock is required: pip install -r requirements-dev.txt"
+            )
+
+        seed, topn = kwargs["seed"], kwargs["topn"]
+        docs, cities = synthetic_rooms(no_rooms, seed)
+        sessions = synthetic_sessions(
+            cities, kwargs["clicks_per_room"], seed=seed
+        )
+        logs = synthetic_logs(sessions, seed)
+
+        db = mongomock.MongoClient().benchmark
+        db.rooms.insert_many(docs)
+        db.logs.insert_many(logs)
+        room_store = RoomStore(db.rooms).load()
+        session_index = SessionIndex(db.logs)
+        session_index.bootstrap(no_limit=len(logs))
+        session_index.ready = True
+
+        results = []
+
+        def add(path, stats):
+            stats.update({"path": path, "rooms": no_rooms})
+            results.append(stats)
+
+        # NOTE: must be convert to string
+        samples = [[str(room_id) for room_id in s] for s in sessions]
+
+        with tempfile.TemporaryDirectory() as root:
+            # the serving training path, its artifacts (model, keyed
+            # vectors, annoy index, neighbor table) saved under `root`
+            with override_settings(BASE_MODEL=root):
+                model, stats = measure_once(
+                    lambda: train_item2vec(samples=samples)
+                )
+            stats["sessions_per_s"] = round(
+                len(sessions) / max(stats["took_s"], 1e-9), 1
+            )
+            add("train_item2vec", stats)
+
+            rng = np.random.RandomState(seed)
+            words = model.wv.index2word
+            room_ids = rng.choice(words, kwargs["queries"]).tolist()
+            session_ids = [
+                "session-{}".format(i)
+                for i in rng.randint(len(sessions), size=kwargs["queries"])
+            ]
+
+            bundle = ModelBundle.load("benchmark-{}".format(no_rooms), root)
+            models = SimpleNamespace(current=bundle, version=bundle.version)
+            with patched(
+                recommenders,
+                models=models,
+                col=db.logs,
+                room_col=db.rooms,
+                room_store=room_store,
+                session_index=session_index,
+                # every query misses, as on a cold cache
+                result_cache=ResultCache(maxsize=0, alias=None)
+            ):
+                add("get_room_similar", measure(
+                    lambda room_id: recommenders.get_room_similar(
+                        room_id, topn, radius_km=None
+                    ),
+                    room_ids
+                ))
+                add("get_room_similar radius", measure(
+                    lambda room_id: recommenders.get_room_similar(
+                        room_id, topn, radius_km=kwargs["radius_km"]
+                    ),
+                    room_ids
+                ))
+                add("get_custom_recommender", measure(
+                    lambda session_id: recommenders.get_custom_recommender(
+                        session_id, None, topn
+                    ),
+                    session_ids
+                ))
+
+                candidates = {
+                    room_id: recommenders.room_candidates(
+                        bundle, room_id, topn
+                    )[1]
+                    for room_id in set(room_ids)
+                }
+                add("cal_lat_long_location", measure(
+                    lambda room_id: recommenders.cal_lat_long_location(
+                        db.rooms, room_id, candidates[room_id],
+                        return_sim=True, topn=topn
+                    ),
+                    room_ids
+                ))
+
+        contents = [doc["content"] for doc in docs[:kwargs["queries"]]]
+        add("preprocess_text", measure(preprocess_text, contents))
+        add("preprocess_text_v2", measure(preprocess_text_v2, contents))
+        return results
+
+    def handle(self, *args, **kwargs):
+        results = []
+        for no_rooms in kwargs["sizes"]:
+            results += self.run_size(no_rooms, kwargs)
+
+        columns = [
+            "path", "rooms", "p50_ms", "p95_ms", "p99_ms", "qps",
+            "took_s", "peak_mb", "max_rss_mb"
+        ]
+        self.stdout.write(tabulate(
+            [[row.get(c, "-") for c in columns] for row in results],
+            headers=columns
+        ))
+
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now().isoformat(),
+            "settings": {
+                key: value for key, value in kwargs.items()
+                if key in ("sizes", "queries", "clicks_per_room", "topn",
+                           "radius_km", "seed")
+            },
+            "results": results,
+        }
+        with open(kwargs["output"], "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            "Benchmark completed :: output:{}".format(kwargs["output"])
+        ))
@@ -0,0 +1,69 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import room_col
+from api.helpers.cleaners import preprocess_text, preprocess_text_v2
+
+
+CORPUS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "fixtures",
+    "cleaners_corpus.json"
+)
+
+
+def chars_per_sec(func, texts, repeat):
+    chars = sum(len(text or "") for text in texts) * repeat
+    start_ = time.time()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return chars / max(time.time() - start_, 1e-9)
+
+
+class Command(BaseCommand):
+    help = "Check preprocess_text_v2 against preprocess_text and benchmark"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--rooms", type=int, default=0,
+            help="Also check the content of N rooms from mongo"
+        )
+
+    def handle(self, *args, **kwargs):
+        with open(CORPUS_PATH) as f:
+            texts = json.load(f)
+
+        if kwargs["rooms"] > 0:
+            cur = room_col.find(
+                {"content": {"$ne": None}}, {"content": 1, "_id": 0}
+            ).limit(kwargs["rooms"])
+            texts += [room["content"] for room in cur]
+
+        # golden output: the reference implementation
+        mismatches = 0
+        for text in texts:
+            expected, result = preprocess_text(text), preprocess_text_v2(text)
+            if expected != result:
+                mismatches += 1
+                self.stdout.write(self.style.ERROR(
+                    "Mismatch :: {!r}\n  expected: {!r}\n  got: {!r}".format(
+                        text[:200], expected, result
+                    )
+                ))
+        if mismatches:
+            raise CommandError(
+                "{} / {} texts differ".format(mismatches, len(texts))
+            )
+
+        for func in (preprocess_text, preprocess_text_v2):
+            self.stdout.write("{}: {:.0f} chars/sec".format(
+                func.__name__, chars_per_sec(func, texts, kwargs["repeat"])
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            "{} texts are equivalent".format(len(texts))
+        ))
@@ -0,0 +1,132 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+import numpy as np
+import requests
+from tabulate import tabulate
+
+from api import models
+from api.helpers.utils import int_list
+
+
+def percentiles(latencies):
+    if not latencies:
+        return [float("nan")] * 3
+    return np.percentile(np.asarray(latencies) * 1000, [50, 95, 99]).tolist()
+
+
+def run_level(url, payloads, concurrency, duration):
+    """
+    `concurrency` threads post `payloads` in a loop for `duration` seconds
+
+    :return (qps, p50, p95, p99, errors): latencies in ms
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(offset):
+        session = requests.Session()
+        i = offset
+        while time.time() < deadline:
+            # multipart, as `RecommenderView` expects
+            payload = {
+                key: (None, str(value))
+                for key, value in payloads[i % len(payloads)].items()
+            }
+            i += concurrency
+            start_ = time.time()
+            try:
+                ok = session.post(url, files=payload, timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            took = time.time() - start_
+            with lock:
+                if ok:
+                    latencies.append(took)
+                else:
+                    errors[0] += 1
+
+    threads = [
+        threading.Thread(target=worker, args=(i, ), daemon=True)
+        for i in range(concurrency)
+    ]
+    start_ = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    qps = len(latencies) / (time.time() - start_)
+    return [round(qps, 1)] + [
+        round(p, 2) for p in percentiles(latencies)
+    ] + [errors[0]]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test recommender endpoints, e.g. the django and the ASGI "
+        "servers, and compare their throughput at a fixed p99"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", action="append", required=True,
+            help="endpoint to test, repeat to compare servers"
+        )
+        parser.add_argument(
+            "--concurrency", type=int_list, default=[1, 4, 16, 64]
+        )
+        parser.add_argument("--duration", type=float, default=10)
+        parser.add_argument("--p99-ms", type=float, default=200)
+        parser.add_argument("--rooms", type=int, default=500)
+        parser.add_argument(
+            "--sessions", type=str, default="",
+            help="comma separated custom_session_ids mixed in the requests"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **kwargs):
+        wv = models.current.wv
+        rng = np.random.RandomState(kwargs["seed"])
+        room_ids = rng.choice(
+            wv.index2word,
+            min(kwargs["rooms"], len(wv.index2word)),
+            replace=False
+        )
+        payloads = [{"room_id": room_id} for room_id in room_ids]
+        payloads += [
+            {"custom_session_id": session_id}
+            for session_id in kwargs["sessions"].split(",") if session_id
+        ]
+        rng.shuffle(payloads)
+
+        rows, best = [], {}
+        for url in kwargs["url"]:
+            for concurrency in kwargs["concurrency"]:
+                row = run_level(
+                    url, payloads, concurrency, kwargs["duration"]
+                )
+                rows.append([url, concurrency] + row)
+                qps, p99, errors = row[0], row[3], row[4]
+                if p99 <= kwargs["p99_ms"] and errors == 0:
+                    best[url] = max(best.get(url, 0), qps)
+
+        self.stdout.write(tabulate(
+            rows,
+            headers=["url", "concurrency", "qps", "p50 ms", "p95 ms",
+                     "p99 ms", "errors"]
+        ))
+
+        base = best.get(kwargs["url"][0])
+        for url in kwargs["url"]:
+            qps = best.get(url)
+            gain = "-"
+            if qps and base:
+                gain = "x{:.2f}".format(qps / base)
+            self.stdout.write(
+                "url:{} - max qps at p99 <= {}ms:{} - gain:{}".format(
+                    url, kwargs["p99_ms"], qps or "-", gain
+                )
+            )
+        self.stdout.write(self.style.SUCCESS("Load test completed"))
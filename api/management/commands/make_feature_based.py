@@ -9,12 +9,32 @@ import pandas as pd
 from sklearn.externals import joblib
 
 from api import room_col
-from api.helpers.pipelines import make_model
+from api.helpers.artifacts import publish_version
+from api.helpers.pipelines import make_model, make_model_chunked
+from api.helpers.rooms import (
+    FB_BATCH_SIZE,
+    FB_FIT_SAMPLE,
+    sample_rooms,
+    stream_rooms
+)
+from api.helpers.utils import save_atomic
 
 
 class Command(BaseCommand):
     help = "Dump feature-based vector"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunked",
+            action="store_true",
+            help="Stream rooms in batches, memory stays flat"
+        )
+        parser.add_argument("--batch-size", type=int, default=FB_BATCH_SIZE)
+        parser.add_argument(
+            "--sample", type=int, default=FB_FIT_SAMPLE,
+            help="No rooms to fit the pipeline on, with --chunked"
+        )
+
     def dump(self):
 
         # connect to MongoDB server
@@ -39,8 +59,9 @@ class Command(BaseCommand):
         full_pl = make_model(rooms)
         del rooms
 
-        joblib.dump(
-            full_pl,
+        # workers memory-map the pickle, replace it
+        save_atomic(
+            lambda fpath: joblib.dump(full_pl, fpath),
             os.path.join(
                 st.BASE_MODEL,
                 "{}.pk".format(st.FEATURE_BASED_KEY)
@@ -51,6 +72,32 @@ class Command(BaseCommand):
         gc.collect()
         time.sleep(5)
 
+    def dump_chunked(self, batch_size, sample_size):
+
+        # filters and projection run by the mongo server
+        sample = sample_rooms(room_col, sample_size)
+        full_pl = make_model_chunked(
+            sample, stream_rooms(room_col, batch_size)
+        )
+        del sample
+
+        # workers memory-map the pickle, replace it
+        save_atomic(
+            lambda fpath: joblib.dump(full_pl, fpath),
+            os.path.join(
+                st.BASE_MODEL,
+                "{}.pk".format(st.FEATURE_BASED_KEY)
+            )
+        )
+
+        # clean up
+        gc.collect()
+
     def handle(self, *args, **kwargs):
-        self.dump()
+        if kwargs.get("chunked"):
+            self.dump_chunked(kwargs["batch_size"], kwargs["sample"])
+        else:
+            self.dump()
+        # serving caches are invalidated by the new version
+        publish_version()
         self.stdout.write(self.style.SUCCESS("Dump feature-based completed"))
@@ -4,29 +4,114 @@ import time
 from django.conf import settings as st
 from django.core.management.base import BaseCommand
 
+from api.helpers.artifacts import publish_version
 from api.helpers.item2vec import (
+    COMPACT_CORPUS_PATH,
+    CORPUS_PATH,
+    SessionCorpus,
+    closed_window,
+    drop_open_sessions,
+    save_watermark,
     make_df,
-    make_samples,
-    filter_sessions,
-    train_item2vec
+    split_sessions,
+    stream_sessions,
+    write_line_corpus,
+    train_item2vec,
+    train_item2vec_incremental
 )
 
 
 class Command(BaseCommand):
     help = "Dump item2vec vector"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Stream sessions to an on-disk corpus, memory stays flat"
+        )
+        parser.add_argument(
+            "--compact",
+            action="store_true",
+            help="Stream sessions to an integer-encoded corpus (.npy)"
+        )
+        parser.add_argument(
+            "--reuse",
+            action="store_true",
+            help="Train from the last saved integer-encoded corpus"
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Retrain only on sessions closed since the last run"
+        )
+
+    def mark(self, window):
+        # incremental runs start after the last closed session trained
+        # on, saved once the model is saved
+        if window is not None:
+            save_watermark(window)
+
     def dump(self):
 
-        df = make_df()
-        sessions = filter_sessions(df, st.MAX_CLICK, st.MIN_CLICK)
-        gen_rooms = make_samples(df, sessions, 1000)
-        train_item2vec(df, sessions, samples=gen_rooms)
-        del df, sessions, gen_rooms
+        # open sessions are trained in full once closed, see `incremental`
+        window = closed_window()
+        df = drop_open_sessions(make_df(), window["closed_before"])
+        # group and filter sessions in a single pass
+        gen_rooms = split_sessions(df, max_=st.MAX_CLICK, min_=st.MIN_CLICK)
+        del df
+        gc.collect()
+
+        train_item2vec(samples=gen_rooms)
+        self.mark(window)
+        del gen_rooms
 
         # clean up
         gc.collect()
         time.sleep(5)
 
+    def dump_stream(self):
+
+        window = closed_window()
+        sessions = stream_sessions(
+            max_=st.MAX_CLICK, min_=st.MIN_CLICK, window=window
+        )
+        write_line_corpus(sessions, CORPUS_PATH)
+        train_item2vec(corpus_file=CORPUS_PATH)
+        self.mark(window)
+
+        # clean up
+        gc.collect()
+
+    def dump_compact(self, reuse=False):
+
+        # the window of a reused corpus is unknown, the watermark stays
+        window = None
+        if reuse:
+            corpus = SessionCorpus.load(COMPACT_CORPUS_PATH)
+        else:
+            window = closed_window()
+            sessions = stream_sessions(
+                max_=st.MAX_CLICK, min_=st.MIN_CLICK, window=window
+            )
+            corpus = SessionCorpus.from_sessions(sessions)
+            corpus.save(COMPACT_CORPUS_PATH)
+        train_item2vec(samples=corpus)
+        self.mark(window)
+        del corpus
+
+        # clean up
+        gc.collect()
+
     def handle(self, *args, **kwargs):
-        self.dump()
+        if kwargs.get("incremental"):
+            train_item2vec_incremental()
+        elif kwargs.get("compact") or kwargs.get("reuse"):
+            self.dump_compact(reuse=kwargs.get("reuse"))
+        elif kwargs.get("stream"):
+            self.dump_stream()
+        else:
+            self.dump()
+        # serving caches are invalidated by the new version
+        publish_version()
         self.stdout.write(self.style.SUCCESS("Dump completed"))
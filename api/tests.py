@@ -1,3 +1,436 @@
-from django.test import TestCase
+import datetime
+import itertools
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase
+from geopy.distance import geodesic
+import numpy as np
+import pandas as pd
+
+from api.forms.room_form import LuxstayBatchForm
+from api.helpers.cleaners import preprocess_text, preprocess_text_v2
+from api.helpers.geo import GeoIndex, haversine
+from api.helpers.item2vec import (
+    SessionCorpus,
+    closed_window,
+    drop_open_sessions,
+    filter_rooms,
+    filter_sessions,
+    load_watermark,
+    save_watermark,
+    split_sessions
+)
+from api.helpers.neighbors import (
+    build_neighbor_table,
+    neighbor_paths,
+    update_neighbor_table
+)
+from api.helpers.recommenders import rerank_by_distance
+from api.helpers.response_format import dict_format
+from api.helpers.tracing import Metrics, Trace
+from api.views.batch_recommender_view import BatchRecommenderView
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class CleanersTest(SimpleTestCase):
+
+    def test_v2_matches_reference_on_corpus(self):
+        # golden output: the reference implementation
+        with open(os.path.join(FIXTURES, "cleaners_corpus.json")) as f:
+            texts = json.load(f)
+        for text in texts:
+            with self.subTest(text=text[:50]):
+                self.assertEqual(
+                    preprocess_text_v2(text), preprocess_text(text)
+                )
+
+    def test_v2_empty(self):
+        self.assertEqual(preprocess_text_v2(None), preprocess_text_v2(""))
+
+
+class BatchFormTest(SimpleTestCase):
+
+    def test_comma_separated(self):
+        form = LuxstayBatchForm({
+            "room_ids": " 1, 2,,3 ", "custom_session_ids": "a,b"
+        })
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["room_ids"], [1, 2, 3])
+        self.assertEqual(form.cleaned_data["custom_session_ids"], ["a", "b"])
+
+    def test_invalid_room_id(self):
+        form = LuxstayBatchForm({"room_ids": "1,x"})
+        self.assertFalse(form.is_valid())
+        self.assertIn("room_ids", form.errors)
+
+    def test_no_items(self):
+        self.assertFalse(LuxstayBatchForm({"topn": "5"}).is_valid())
+
+    def test_too_many_items(self):
+        with mock.patch("api.forms.room_form.BATCH_MAX_ITEMS", 2):
+            form = LuxstayBatchForm({
+                "room_ids": "1,2", "custom_session_ids": "a"
+            })
+            self.assertFalse(form.is_valid())
+
+
+class BatchRecommenderViewTest(SimpleTestCase):
+
+    def post(self, data):
+        request = RequestFactory().post("/luxstay/batch", data)
+        return BatchRecommenderView.as_view()(request)
+
+    def test_one_result_per_item_in_order(self):
+        rooms = [
+            dict_format(code=200, message="Recommend by item2vec",
+                        data=[["2", 0.9, 1.5]], errors=False),
+            dict_format(code=500, message="Room not found",
+                        data=[], errors=False),
+        ]
+        sessions = [
+            dict_format(code=200, message="Custom recommender successfully.",
+                        data=[["3", 0.8]], errors=False),
+        ]
+        module = "api.views.batch_recommender_view."
+        with mock.patch(module + "get_rooms_similar_batch",
+                        return_value=rooms) as rooms_batch, \
+                mock.patch(module + "get_custom_recommender_batch",
+                           return_value=sessions) as sessions_batch:
+            response = self.post({
+                "room_ids": "1,404", "custom_session_ids": "s1", "topn": "5"
+            })
+
+        rooms_batch.assert_called_once_with([1, 404], 5)
+        sessions_batch.assert_called_once_with(["s1"], 5)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode("utf-8"))["data"]
+        self.assertEqual(
+            [(r["room_id"], r["code"]) for r in data["rooms"]],
+            [(1, 200), (404, 500)]
+        )
+        self.assertEqual(data["sessions"][0]["custom_session_id"], "s1")
+        self.assertEqual(data["sessions"][0]["data"], [["3", 0.8]])
+
+    def test_rooms_only(self):
+        module = "api.views.batch_recommender_view."
+        with mock.patch(module + "get_rooms_similar_batch",
+                        return_value=[dict_format(data=[])]), \
+                mock.patch(module + "get_custom_recommender_batch") \
+                as sessions_batch:
+            response = self.post({"room_ids": "1"})
+        sessions_batch.assert_not_called()
+        data = json.loads(response.content.decode("utf-8"))["data"]
+        self.assertEqual(data["sessions"], [])
+
+    def test_invalid_form(self):
+        response = self.post({"room_ids": "x"})
+        self.assertEqual(response.status_code, 422)
+
+
+class GeoIndexTest(SimpleTestCase):
+
+    def test_within_matches_haversine(self):
+        rng = np.random.RandomState(0)
+        ids = np.arange(1, 2001, dtype=np.int64)
+        lats = rng.uniform(8.0, 23.0, len(ids))
+        longs = rng.uniform(102.0, 110.0, len(ids))
+        index = GeoIndex(ids, lats, longs)
+
+        for lat, long, radius_km in [
+            (21.0278, 105.8342, 5), (10.8231, 106.6297, 50),
+            (16.0544, 108.2022, 300), (0.0, 0.0, 100)
+        ]:
+            dists = haversine(lat, long, lats, longs)
+            # points on the boundary may fall on either side
+            clear = np.abs(dists - radius_km) > 1e-6
+            expected = set(ids[(dists <= radius_km) & clear])
+            result = set(index.within(lat, long, radius_km))
+            self.assertEqual(result - set(ids[~clear]), expected)
+
+    def test_unknown_coordinates_are_skipped(self):
+        index = GeoIndex(
+            np.array([1, 2, 3]),
+            np.array([21.0, np.nan, 21.0]),
+            np.array([105.0, 105.0, np.nan])
+        )
+        self.assertEqual(len(index), 1)
+        self.assertEqual(list(index.within(21.0, 105.0, 1)), [1])
+
+    def test_empty(self):
+        index = GeoIndex(
+            np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        )
+        self.assertEqual(len(index.within(21.0, 105.0, 10)), 0)
+
+
+class MetricsTest(SimpleTestCase):
+
+    def test_render_cumulative_buckets(self):
+        metrics = Metrics(name="stage_seconds", buckets=(0.1, 1.0))
+        metrics.observe([
+            ("room", "ann_query", 0.05), ("room", "ann_query", 0.5),
+            ("room", "ann_query", 2.0), ("room", "rerank", 0.1),
+        ])
+        labels = 'pid="{}",request="room",stage="{}"'
+        ann, rerank = (
+            labels.format(os.getpid(), stage)
+            for stage in ("ann_query", "rerank")
+        )
+        self.assertEqual(metrics.render().splitlines()[2:], [
+            'stage_seconds_bucket{%s,le="0.1"} 1' % ann,
+            'stage_seconds_bucket{%s,le="1.0"} 2' % ann,
+            'stage_seconds_bucket{%s,le="+Inf"} 3' % ann,
+            "stage_seconds_sum{%s} 2.55" % ann,
+            "stage_seconds_count{%s} 3" % ann,
+            # upper bounds are inclusive
+            'stage_seconds_bucket{%s,le="0.1"} 1' % rerank,
+            'stage_seconds_bucket{%s,le="1.0"} 1' % rerank,
+            'stage_seconds_bucket{%s,le="+Inf"} 1' % rerank,
+            "stage_seconds_sum{%s} 0.1" % rerank,
+            "stage_seconds_count{%s} 1" % rerank,
+        ])
+
+    def test_finish_observes_one_sample_per_stage(self):
+        metrics = Metrics()
+        trace = Trace("room")
+        trace.spans = [("embedding", 0.01), ("embedding", 0.02)]
+        with mock.patch("api.helpers.tracing.metrics", metrics):
+            trace.finish()
+        hist = metrics._histograms[("room", "embedding")]
+        self.assertEqual(hist.count, 1)
+        self.assertAlmostEqual(hist.sum, 0.03)
+        self.assertEqual(metrics._histograms[("room", "total")].count, 1)
+
+
+def baseline_rerank(main_id, room_ids, lat_long, sort=True,
+                    return_distance=False, return_sim=False,
+                    reverse=False, topn=20):
+    # `cal_lat_long_location` before the batched lookup, one geodesic
+    # per candidate
+    main_lat_long = lat_long[int(main_id)]
+    lat_long_dist = []
+    for room_id, sim in room_ids:
+        try:
+            dist = geodesic(lat_long[int(room_id)], main_lat_long).kilometers
+            lat_long_dist.append((room_id, sim, dist))
+        except Exception:
+            continue
+
+    if sort:
+        lat_long_dist.sort(key=lambda x: x[2], reverse=reverse)
+    if not return_sim:
+        lat_long_dist = [sample[:1] for sample in lat_long_dist]
+    if not return_distance:
+        lat_long_dist = [sample[:2] for sample in lat_long_dist]
+    return lat_long_dist[:topn]
+
+
+class RerankByDistanceTest(SimpleTestCase):
+
+    def setUp(self):
+        # candidates north of the main room, 1km to 400km away
+        self.lat_long = {1: (21.0, 105.8)}
+        self.room_ids = []
+        for room_id, km in [(2, 30), (3, 1), (4, 400), (5, 12), (6, 90)]:
+            self.lat_long[room_id] = (21.0 + km / 111.0, 105.8)
+            self.room_ids.append((str(room_id), 1.0 / room_id))
+        # unknown coordinates and ids are skipped
+        self.room_ids += [("7", 0.1), ("not-a-room", 0.05)]
+
+    def test_flags_match_baseline(self):
+        for sort, reverse, return_sim, return_distance, topn in \
+                itertools.product([True, False], [True, False],
+                                  [True, False], [True, False], [3, 20]):
+            flags = dict(
+                sort=sort, reverse=reverse, return_sim=return_sim,
+                return_distance=return_distance, topn=topn
+            )
+            with self.subTest(**flags):
+                result = rerank_by_distance(
+                    1, self.room_ids, self.lat_long, **flags
+                )
+                expected = baseline_rerank(
+                    1, self.room_ids, self.lat_long, **flags
+                )
+                self.assertEqual(
+                    [sample[:2] for sample in result],
+                    [sample[:2] for sample in expected]
+                )
+                for sample, ref in zip(result, expected):
+                    self.assertEqual(len(sample), len(ref))
+                    if len(ref) == 3:
+                        # haversine (sphere) vs geodesic (ellipsoid)
+                        self.assertLess(
+                            abs(sample[2] - ref[2]), 0.01 * ref[2]
+                        )
+
+    def test_main_room_not_found(self):
+        with self.assertRaises(IndexError):
+            rerank_by_distance(404, self.room_ids, self.lat_long)
+
+
+def click_logs(seed=0, no_logs=500):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        "custom_session_id": rng.choice(
+            ["s{}".format(i) for i in range(60)], no_logs
+        ),
+        "room_id": rng.randint(1, 100, no_logs),
+    })
+    # logs without a session id are never a session
+    df.loc[rng.choice(no_logs, 10, replace=False), "custom_session_id"] = \
+        None
+    return df
+
+
+class SplitSessionsTest(SimpleTestCase):
+
+    def baseline(self, df, sessions):
+        # `gen_sessions` before the sort-based split
+        return [
+            list(filter_rooms(df, k).values.astype(str))
+            for k in sessions.index
+        ]
+
+    def test_matches_filter_rooms(self):
+        df = click_logs()
+        for max_, min_ in [(11, 3), (1000, 1), (5, 5)]:
+            with self.subTest(max_=max_, min_=min_):
+                sessions = filter_sessions(df, max_=max_, min_=min_)
+                expected = self.baseline(df, sessions)
+                # sessions come in first-click order, not by size
+                self.assertEqual(
+                    sorted(split_sessions(df, sessions)), sorted(expected)
+                )
+                self.assertEqual(
+                    sorted(split_sessions(df, max_=max_, min_=min_)),
+                    sorted(expected)
+                )
+
+    def test_empty(self):
+        df = pd.DataFrame(columns=["custom_session_id", "room_id"])
+        self.assertEqual(split_sessions(df), [])
+
+
+class SessionCorpusTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        sessions = [[3, 1, 3], ["42"], [], [1, 7]]
+        corpus = SessionCorpus.from_sessions(sessions)
+        expected = [[str(int(r)) for r in s] for s in sessions]
+        self.assertEqual(list(corpus), expected)
+        self.assertEqual(corpus.total_words, 6)
+
+        with tempfile.TemporaryDirectory() as root:
+            prefix = os.path.join(root, "corpus")
+            corpus.save(prefix)
+            loaded = SessionCorpus.load(prefix)
+            self.assertEqual(len(loaded), len(sessions))
+            self.assertEqual(list(loaded), expected)
+            # iterable again, once per epoch
+            self.assertEqual(list(loaded), expected)
+            self.assertEqual(sorted(loaded.words), ["1", "3", "42", "7"])
+
+
+class NeighborTableTest(SimpleTestCase):
+
+    def test_update_matches_rebuild(self):
+        rng = np.random.RandomState(0)
+        old = rng.normal(size=(200, 8)).astype(np.float32)
+        new = np.vstack([old, rng.normal(size=(20, 8)).astype(np.float32)])
+        changed = np.array([3, 50, 199])
+        new[changed] = rng.normal(size=(len(changed), 8))
+
+        with tempfile.TemporaryDirectory() as root:
+            prefix = os.path.join(root, "updated")
+            full = os.path.join(root, "full")
+            build_neighbor_table(SimpleNamespace(vectors=old), prefix, 10)
+            old_ids, old_sims = (
+                np.load(fpath) for fpath in neighbor_paths(prefix)
+            )
+            update_neighbor_table(
+                SimpleNamespace(vectors=new), changed, prefix, 10
+            )
+            build_neighbor_table(SimpleNamespace(vectors=new), full, 10)
+            ids, sims = (np.load(fpath) for fpath in neighbor_paths(prefix))
+            full_ids, full_sims = (
+                np.load(fpath) for fpath in neighbor_paths(full)
+            )
+
+        self.assertEqual(ids.shape, (220, 10))
+        # changed and added rooms are recomputed
+        updated = np.union1d(changed, np.arange(200, 220))
+        np.testing.assert_array_equal(ids[updated], full_ids[updated])
+        np.testing.assert_allclose(
+            sims[updated], full_sims[updated], rtol=1e-5
+        )
+        # the other rows are kept as they were
+        kept = np.setdiff1d(np.arange(200), updated)
+        np.testing.assert_array_equal(ids[kept], old_ids[kept])
+        np.testing.assert_array_equal(sims[kept], old_sims[kept])
+
+
+class ClosedWindowTest(SimpleTestCase):
+
+    newest = datetime.datetime(2019, 5, 1, 12, 0)
+
+    def test_first_window(self):
+        window = closed_window(newest=self.newest, session_gap=1800)
+        self.assertIsNone(window["closed_after"])
+        self.assertEqual(
+            window["closed_before"], datetime.datetime(2019, 5, 1, 11, 30)
+        )
+
+    def test_watermark_advances(self):
+        with tempfile.TemporaryDirectory() as root:
+            fpath = os.path.join(root, "watermark.json")
+            self.assertIsNone(load_watermark(fpath))
+
+            first = closed_window(newest=self.newest, session_gap=1800)
+            save_watermark(first, fpath)
+            watermark = load_watermark(fpath)
+            self.assertEqual(watermark, {
+                "closed_before": first["closed_before"]
+            })
+
+            # the next window starts where the last one ended
+            later = self.newest + datetime.timedelta(hours=2)
+            second = closed_window(watermark, later, session_gap=1800)
+            self.assertEqual(second["closed_after"], first["closed_before"])
+            self.assertEqual(
+                second["closed_before"],
+                datetime.datetime(2019, 5, 1, 13, 30)
+            )
+
+    def test_never_moves_back(self):
+        watermark = {"closed_before": self.newest}
+        window = closed_window(watermark, self.newest, session_gap=1800)
+        self.assertEqual(window["closed_before"], self.newest)
+        self.assertEqual(window["closed_after"], self.newest)
+
+    def test_old_watermark_format(self):
+        with tempfile.TemporaryDirectory() as root:
+            fpath = os.path.join(root, "watermark.json")
+            with open(fpath, "w") as f:
+                json.dump({"last_id": "5cc9a8e1"}, f)
+            self.assertIsNone(load_watermark(fpath))
+
+    def test_drop_open_sessions(self):
+        minute = datetime.timedelta(minutes=1)
+        df = pd.DataFrame({
+            "custom_session_id": ["closed", "closed", "open", "open"],
+            "room_id": [1, 2, 3, 4],
+            "created_at": [
+                self.newest - 90 * minute, self.newest - 60 * minute,
+                self.newest - 90 * minute, self.newest - 10 * minute,
+            ],
+        })
+        kept = drop_open_sessions(df, self.newest - 30 * minute)
+        # the whole session or nothing
+        self.assertEqual(kept["room_id"].tolist(), [1, 2])
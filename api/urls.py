@@ -1,9 +1,19 @@
 from django.urls import path
+from api.views.batch_recommender_view import BatchRecommenderView
+from api.views.metrics_view import MetricsView
 from api.views.recommender_view import RecommenderView
+from api.views.stats_view import StatsView
 
 
 app_name = 'luxstay_api'
 
 urlpatterns = [
-    path('luxstay', RecommenderView.as_view(), name='luxstay')
+    path('luxstay', RecommenderView.as_view(), name='luxstay'),
+    path(
+        'luxstay/batch',
+        BatchRecommenderView.as_view(),
+        name='luxstay_batch'
+    ),
+    path('luxstay/stats', StatsView.as_view(), name='luxstay_stats'),
+    path('luxstay/metrics', MetricsView.as_view(), name='luxstay_metrics'),
 ]
@@ -0,0 +1,58 @@
+import logging
+
+from django.http import JsonResponse
+from rest_framework.parsers import MultiPartParser
+from rest_framework.views import APIView
+
+from api.forms.room_form import LuxstayBatchForm
+from api.helpers.recommenders import (
+    get_rooms_similar_batch,
+    get_custom_recommender_batch
+)
+from api.helpers.response_format import json_format
+from api.helpers.tracing import start_trace
+
+
+class BatchRecommenderView(APIView):
+    parser_classes = (MultiPartParser, )
+
+    def post(self, request):
+        form = LuxstayBatchForm(request.POST, )
+        if not form.is_valid():
+            return JsonResponse(form.errors, status=422)
+
+        room_ids = form.cleaned_data.get("room_ids") or []
+        custom_session_ids = form.cleaned_data.get("custom_session_ids") or []
+        topn = form.cleaned_data.get("topn") or 20
+
+        with start_trace("batch"):
+            logging.info(
+                "Batch recommender :: rooms:%d - sessions:%d",
+                len(room_ids), len(custom_session_ids)
+            )
+            # one result per item, in the same envelope as single requests
+            rooms, sessions = [], []
+            if room_ids:
+                rooms = get_rooms_similar_batch(room_ids, topn)
+            if custom_session_ids:
+                sessions = get_custom_recommender_batch(
+                    custom_session_ids, topn
+                )
+
+            return json_format(
+                code=200,
+                message="Batch recommend successfully.",
+                data={
+                    "rooms": [
+                        dict(result, room_id=room_id)
+                        for room_id, result in zip(room_ids, rooms)
+                    ],
+                    "sessions": [
+                        dict(result, custom_session_id=custom_session_id)
+                        for custom_session_id, result in zip(
+                            custom_session_ids, sessions
+                        )
+                    ],
+                },
+                errors=False
+            )
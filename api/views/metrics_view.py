@@ -0,0 +1,14 @@
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from api.helpers.tracing import metrics
+
+
+class MetricsView(APIView):
+
+    def get(self, request):
+        # monitoring: stage histograms of the sampled requests of this
+        # process, scraped by prometheus
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4"
+        )
@@ -6,9 +6,11 @@ from rest_framework.views import APIView
 
 from api.forms.room_form import LuxstayRoomForm
 from api.helpers.recommenders import (
+    GEO_RADIUS_KM,
     get_room_similar,
     get_custom_recommender
 )
+from api.helpers.tracing import start_trace
 
 
 class RecommenderView(APIView):
@@ -39,9 +41,16 @@ class RecommenderView(APIView):
                 ip_address or None
             )
             # filter by `custom_session_id` or both
-            result = get_custom_recommender(custom_session_id, ip_address, 20)
+            with start_trace("custom_recommender"):
+                result = get_custom_recommender(
+                    custom_session_id, ip_address, 20
+                )
         else:
-            result = get_room_similar(room_id, 20)
+            radius_km = form.cleaned_data.get("radius_km")
+            if radius_km is None:
+                radius_km = GEO_RADIUS_KM
+            with start_trace("room_similar"):
+                result = get_room_similar(room_id, 20, radius_km)
 
         # return list of tuples
         # (room_id, similarity) with item2vec
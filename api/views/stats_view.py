@@ -0,0 +1,23 @@
+from rest_framework.views import APIView
+
+from api import models, result_cache
+from api.helpers.artifacts import startup_stats
+from api.helpers.response_format import json_format
+
+
+class StatsView(APIView):
+
+    def get(self, request):
+        # monitoring: cache hit/miss counters, loaded indexes and
+        # startup time of each artifact
+        return json_format(
+            code=200,
+            message="Stats",
+            data={
+                "result_cache": result_cache.stats(),
+                "model_version": models.version,
+                "indexes": models.current.indexes.stats(),
+                "artifacts": startup_stats,
+            },
+            errors=False
+        )
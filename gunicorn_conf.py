@@ -0,0 +1,42 @@
+"""
+gunicorn settings, the models are loaded once in the master:
+
+    gunicorn -c gunicorn_conf.py <project>.wsgi
+
+The item2vec vectors, neighbor table and annoy indexes are memory-mapped
+before the workers are forked, so their pages are shared and a new
+worker starts without loading anything.
+
+Background refreshes (room store, session index, model versions) start
+in each worker once it is initialized, never in the master. gevent
+workers are not supported with `preload_app`: the app, its locks and
+mongo clients would be created before gevent patches them.
+"""
+import gc
+import multiprocessing
+import os
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:9000")
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1)
+)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = True
+
+# read by `api` when the master preloads it, see `api.start`
+os.environ["API_DEFER_START"] = "1"
+
+
+def pre_fork(server, worker):
+    # objects loaded by the master are never collected, so the workers
+    # do not write to their pages (python >= 3.7)
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    from api import start
+    start()